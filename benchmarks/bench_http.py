@@ -0,0 +1,139 @@
+"""
+Heartbeat latency under /api/servers load.
+
+Starts MonitorHandler on a local port with --servers entries in the
+registry, hammers --path (by default a page of /api/servers, which is
+encoded per request rather than served from the cached blob) from
+--load-clients threads in a separate process, holds --idle-connections
+keep-alive connections open without sending anything, and measures
+/heartbeat latency on a keep-alive session. Runs once with the old
+single-threaded HTTPServer and once with PooledHTTPServer.
+
+    python benchmarks/bench_http.py --duration 5 --load-clients 16
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import HTTPServer
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+import requests
+
+import main as monitor
+
+logging.disable(logging.INFO)
+
+
+def seed_registry(count):
+    for i in range(count):
+        monitor.server_registry.add({
+            "name": f"server-{i:05d}", "url": f"https://example-{i}.com", "status": "online",
+            "last_ping": monitor.datetime.now(), "response_time": 42.0, "total_pings": i,
+        })
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))], 2)
+
+
+def load(url, clients, duration, results):
+    """Runs in its own process, so the load generator's threads don't compete with the server for the GIL"""
+    calls = [0] * clients
+    end = time.time() + duration
+
+    def client(index):
+        session = requests.Session()
+        while time.time() < end:
+            try:
+                session.get(url, timeout=30)
+                calls[index] += 1
+            except requests.RequestException:
+                pass
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(duration + 30)
+    results.put(sum(calls))
+
+
+def run(server_class, duration, load_clients, path, idle_connections):
+    httpd = server_class(("127.0.0.1", 0), monitor.MonitorHandler)
+    base = f"http://127.0.0.1:{httpd.server_address[1]}"
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    # Connected but silent, like a browser tab between polls
+    idle = [socket.create_connection(httpd.server_address) for _ in range(idle_connections)]
+
+    results = multiprocessing.Queue()
+    loader = None
+    if load_clients:
+        loader = multiprocessing.Process(target=load, args=(base + path, load_clients, duration + 0.5, results))
+        loader.start()
+        time.sleep(0.5)
+
+    latencies = []
+    errors = 0
+    session = requests.Session()
+    end = time.time() + duration
+    while time.time() < end:
+        start = time.perf_counter()
+        try:
+            session.get(f"{base}/heartbeat", timeout=5)
+            latencies.append((time.perf_counter() - start) * 1000)
+        except requests.RequestException:
+            errors += 1
+        time.sleep(0.01)
+
+    api_calls = 0
+    if loader is not None:
+        api_calls = results.get()
+        loader.join()
+    for sock in idle:
+        sock.close()
+    httpd.shutdown()
+    httpd.server_close()
+    return {
+        "server": server_class.__name__,
+        "heartbeats": len(latencies),
+        "heartbeat_errors": errors,
+        "heartbeat_p50_ms": percentile(latencies, 50),
+        "heartbeat_p99_ms": percentile(latencies, 99),
+        "api_servers_per_sec": round(api_calls / duration, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--load-clients", type=int, default=16)
+    parser.add_argument("--servers", type=int, default=2000, help="registry size")
+    parser.add_argument("--path", default="/api/servers?limit=1000", help="endpoint the load clients request")
+    parser.add_argument("--idle-connections", type=int, default=0, help="silent keep-alive connections held open")
+    args = parser.parse_args()
+
+    seed_registry(args.servers)
+    for server_class in (HTTPServer, monitor.PooledHTTPServer):
+        for clients in (0, args.load_clients):
+            result = run(server_class, args.duration, clients, args.path, args.idle_connections)
+            p50 = result["heartbeat_p50_ms"]
+            p99 = result["heartbeat_p99_ms"]
+            print(f"{result['server']:<18} load={clients:<3} idle={args.idle_connections:<3} "
+                  f"heartbeat p50={'n/a' if p50 is None else f'{p50}ms':>9} "
+                  f"p99={'n/a' if p99 is None else f'{p99}ms':>9} "
+                  f"errors={result['heartbeat_errors']} api/s={result['api_servers_per_sec']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Idle CPU of the keep-alive system.
+
+Starts the HTTP server and every UltimateKeepAlive component on the shared
+TimerService with no servers to ping, then samples process CPU time for
+--duration seconds. With --busy-loop it also measures the old pattern of
+three threads polling with sub-millisecond sleeps, for comparison.
+
+    python benchmarks/bench_idle.py --duration 10 --busy-loop
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+import psutil
+
+import main as monitor
+
+logging.disable(logging.INFO)
+
+
+def measure(duration):
+    process = psutil.Process()
+    before = process.cpu_times()
+    wakeups = monitor.timer_service.wakeups
+    time.sleep(duration)
+    after = process.cpu_times()
+    cpu = (after.user - before.user) + (after.system - before.system)
+    return {
+        "cpu_seconds": round(cpu, 3),
+        "cpu_percent": round(cpu / duration * 100, 2),
+        "timer_wakeups": monitor.timer_service.wakeups - wakeups,
+    }
+
+
+def busy_loops(stop):
+    """The pre-timer-service loops: three threads sleeping 0.1 ms at a time"""
+    def loop():
+        while not stop.is_set():
+            time.sleep(0.0001)
+
+    for _ in range(3):
+        threading.Thread(target=loop, daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--busy-loop", action="store_true", help="also measure the old polling loops")
+    args = parser.parse_args()
+
+    httpd = monitor.PooledHTTPServer(("127.0.0.1", 0), monitor.MonitorHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    monitor.HTTP_PORT = httpd.server_address[1]
+    monitor.keep_alive.app_url = monitor.keep_alive.self_pinger.app_url = f"http://127.0.0.1:{monitor.HTTP_PORT}"
+    monitor.keep_alive.setup()
+    time.sleep(1)
+
+    result = measure(args.duration)
+    print(f"timer service: cpu={result['cpu_percent']}% ({result['cpu_seconds']}s) "
+          f"wakeups={result['timer_wakeups']} over {args.duration}s")
+
+    if args.busy_loop:
+        stop = threading.Event()
+        busy_loops(stop)
+        result = measure(args.duration)
+        stop.set()
+        print(f"busy loops:    cpu={result['cpu_percent']}% ({result['cpu_seconds']}s) over {args.duration}s")
+
+
+if __name__ == "__main__":
+    main()
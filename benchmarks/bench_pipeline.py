@@ -0,0 +1,265 @@
+"""
+Throughput of the ping pipeline against local stand-ins.
+
+Starts --targets stub HTTP servers on local ports whose responses take
+--latency-ms (with --jitter-ms), fail with a 500 at --error-rate and hang
+past the ping timeout at --timeout-rate. The servers collection is replaced
+by an in-process stand-in that counts database operations. For every fleet
+size it syncs the registry, runs --rounds ping rounds through ping_engine
+and ping_server, flushes the result writer and times /api/servers.
+
+    python benchmarks/bench_pipeline.py --fleets 10,100,1000,10000 --output results.json
+    python benchmarks/bench_pipeline.py --baseline results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+import psutil
+import requests
+
+import main as monitor
+
+logging.disable(logging.CRITICAL)
+
+
+class StubConfig:
+    latency_ms = 20
+    jitter_ms = 5
+    error_rate = 0.0
+    timeout_rate = 0.0
+    hang_seconds = 3
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Target server with configurable latency, errors and hangs"""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        roll = random.random()
+        if roll < StubConfig.timeout_rate:
+            time.sleep(StubConfig.hang_seconds)
+        else:
+            delay = StubConfig.latency_ms + random.uniform(-StubConfig.jitter_ms, StubConfig.jitter_ms)
+            time.sleep(max(delay, 0) / 1000)
+        status = 500 if roll > 1 - StubConfig.error_rate else 200
+        body = b"ok" if status == 200 else b"error"
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_HEAD = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        pass  # Hung responses hit a closed socket once the pinger times out
+
+
+class CountingCollection:
+    """Stand-in for the servers collection that counts round trips and documents"""
+    name = "servers"
+
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+        self.calls = 0
+        self.documents = 0
+        self._lock = threading.Lock()
+
+    def _count(self, documents=1):
+        with self._lock:
+            self.calls += 1
+            self.documents += documents
+
+    def bulk_update(self, updates):
+        self._count(len(updates))
+
+    def update_one(self, *args, **kwargs):
+        self._count()
+
+    def find(self, *args, **kwargs):
+        self._count(len(self.docs))
+        return list(self.docs)
+
+    def find_one(self, *args, **kwargs):
+        self._count()
+        return None
+
+    def reset(self):
+        with self._lock:
+            self.calls = self.documents = 0
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))], 2)
+
+
+def start_targets(count):
+    bases = []
+    for _ in range(count):
+        httpd = StubServer(("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        bases.append(f"http://127.0.0.1:{httpd.server_address[1]}")
+    return bases
+
+
+def build_fleet(size, bases):
+    return [{"name": f"server-{i}", "url": f"{bases[i % len(bases)]}/s{i}", "status": "unknown",
+             "interval": monitor.DEFAULT_PING_INTERVAL} for i in range(size)]
+
+
+def timed_ping_server(latencies, timeout):
+    """Wrap ping_server so each call is timed and uses the benchmark's timeout"""
+    original = monitor.ping_server
+
+    def ping(*args, **kwargs):
+        kwargs["timeout"] = timeout
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            latencies.append((time.perf_counter() - start) * 1000)
+    return ping
+
+
+def run_fleet(size, bases, rounds, api_base, ping_timeout):
+    fleet = build_fleet(size, bases)
+    coll = CountingCollection(fleet)
+    monitor.collection = coll
+    process = psutil.Process()
+
+    start = time.perf_counter()
+    monitor.server_registry.sync(coll.find({}, {"_id": 0}))
+    sync_ms = (time.perf_counter() - start) * 1000
+    coll.reset()
+
+    latencies = []
+    original = monitor.ping_server
+    monitor.ping_server = timed_ping_server(latencies, ping_timeout)
+    cpu_before = process.cpu_times()
+    durations = []
+    online = offline = 0
+    try:
+        for _ in range(rounds):
+            ok, failed, duration = monitor.ping_engine.run_round(monitor.server_registry.all())
+            online += ok
+            offline += failed
+            durations.append(duration)
+        monitor.result_writer.flush()
+    finally:
+        monitor.ping_server = original
+    cpu_after = process.cpu_times()
+    cpu = (cpu_after.user - cpu_before.user) + (cpu_after.system - cpu_before.system)
+    pings = online + offline
+    elapsed = sum(durations)
+
+    api_latencies = []
+    session = requests.Session()
+    for _ in range(5):
+        start = time.perf_counter()
+        session.get(f"{api_base}/api/servers", timeout=60)
+        api_latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "fleet": size,
+        "rounds": rounds,
+        "pings": pings,
+        "failed": offline,
+        "pings_per_sec": round(pings / elapsed, 1) if elapsed else None,
+        "round_duration_s": round(elapsed / rounds, 3),
+        "ping_p50_ms": percentile(latencies, 50),
+        "ping_p99_ms": percentile(latencies, 99),
+        "db_calls_per_ping": round(coll.calls / pings, 4) if pings else None,
+        "db_docs_per_ping": round(coll.documents / pings, 4) if pings else None,
+        "registry_sync_ms": round(sync_ms, 2),
+        "api_servers_p50_ms": percentile(api_latencies, 50),
+        "cpu_seconds": round(cpu, 3),
+        "cpu_percent": round(cpu / elapsed * 100, 1) if elapsed else None,
+        "rss_mb": round(process.memory_info().rss / 2 ** 20, 1),
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {row["fleet"]: row for row in json.load(f)["results"]}
+    for row in results:
+        old = baseline.get(row["fleet"])
+        if not old:
+            continue
+        changes = []
+        for key in ("pings_per_sec", "round_duration_s", "ping_p99_ms", "db_calls_per_ping", "rss_mb"):
+            if old.get(key) and row.get(key) is not None:
+                changes.append(f"{key} {(row[key] - old[key]) / old[key] * 100:+.1f}%")
+        print(f"fleet={row['fleet']:<6} vs baseline: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fleets", default="10,100,1000,10000", help="comma separated fleet sizes")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--targets", type=int, default=8, help="stub HTTP servers (distinct hosts)")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--ping-timeout", type=float, default=2)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON from an earlier run to compare against")
+    args = parser.parse_args()
+
+    StubConfig.latency_ms = args.latency_ms
+    StubConfig.jitter_ms = args.jitter_ms
+    StubConfig.error_rate = args.error_rate
+    StubConfig.timeout_rate = args.timeout_rate
+    StubConfig.hang_seconds = args.ping_timeout + 1
+
+    bases = start_targets(args.targets)
+    api = monitor.PooledHTTPServer(("127.0.0.1", 0), monitor.MonitorHandler)
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    api_base = f"http://127.0.0.1:{api.server_address[1]}"
+    monitor.result_writer.start()
+
+    results = []
+    for size in (int(n) for n in args.fleets.split(",")):
+        row = run_fleet(size, bases, args.rounds, api_base, args.ping_timeout)
+        results.append(row)
+        print(f"fleet={row['fleet']:<6} pings/s={row['pings_per_sec']:<8} round={row['round_duration_s']}s "
+              f"p99={row['ping_p99_ms']}ms db_calls/ping={row['db_calls_per_ping']} "
+              f"api p50={row['api_servers_p50_ms']}ms cpu={row['cpu_percent']}% rss={row['rss_mb']}MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "config": vars(args),
+                "python": platform.python_version(),
+                "ping_concurrency": monitor.ping_engine.max_in_flight,
+                "per_host_limit": monitor.ping_engine.per_host_limit,
+                "results": results,
+            }, f, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
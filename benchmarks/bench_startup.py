@@ -0,0 +1,125 @@
+"""
+Cold start to first ping.
+
+Seeds a SQLite database with --servers never-pinged servers pointing at a
+local stub, then launches `python main.py` --runs times and polls /ready.
+Reports when the HTTP port first answered, when /ready flipped to 200 and
+the first_ping_ms the process measured from its own creation time.
+
+    python benchmarks/bench_startup.py --servers 1000 --runs 5
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import logging
+import requests
+
+import main as monitor
+
+logging.disable(logging.INFO)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # The monitor under test is killed mid-connection at the end of each run
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed(path, servers, target):
+    db = monitor.SqliteStorage(path)
+    coll = db.collection(monitor.COLLECTION_NAME)
+    with db.transaction():
+        for i in range(servers):
+            coll.insert_one({"name": f"server-{i}", "url": f"{target}/s{i}", "status": "pending",
+                             "created_at": datetime.now(), "last_ping": None,
+                             "interval": monitor.DEFAULT_PING_INTERVAL})
+    db.close()
+
+
+def run_once(path, timeout):
+    port = free_port()
+    env = dict(os.environ, STORAGE_BACKEND="sqlite", SQLITE_PATH=path, PORT=str(port),
+               RENDER_EXTERNAL_URL=f"http://127.0.0.1:{port}")
+    env.pop("MONGO_URI", None)
+    launched = time.time()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py")], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {"port_ms": None, "ready_ms": None, "first_ping_ms": None}
+    session = requests.Session()
+    try:
+        deadline = launched + timeout
+        while time.time() < deadline:
+            try:
+                response = session.get(f"http://127.0.0.1:{port}/ready", timeout=1)
+            except requests.RequestException:
+                time.sleep(0.005)
+                continue
+            elapsed = round((time.time() - launched) * 1000, 1)
+            if result["port_ms"] is None:
+                result["port_ms"] = elapsed
+            if response.status_code == 200 and result["ready_ms"] is None:
+                result["ready_ms"] = elapsed
+            first_ping = response.json().get("first_ping_ms")
+            if first_ping is not None:
+                result["first_ping_ms"] = first_ping
+                break
+            time.sleep(0.005)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    stub = StubServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "monitor.db")
+        seed(path, args.servers, f"http://127.0.0.1:{stub.server_address[1]}")
+        for run in range(args.runs):
+            result = run_once(path, args.timeout)
+            print(f"run {run + 1}: port={result['port_ms']}ms ready={result['ready_ms']}ms "
+                  f"first_ping={result['first_ping_ms']}ms (servers={args.servers})")
+
+
+if __name__ == "__main__":
+    main()
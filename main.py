@@ -2,44 +2,734 @@ import time
 import requests
 import random
 import logging
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import logging.handlers
+import queue
+import atexit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import threading
-from urllib.parse import parse_qs, urlparse
-from pymongo import MongoClient
+from urllib.parse import parse_qs, urlparse, urlunparse
+from pymongo import MongoClient, UpdateOne, UpdateMany
+from pymongo.errors import PyMongoError, BulkWriteError, OperationFailure
 import os
 from datetime import datetime, timedelta
 import json
 import psutil
+import hashlib
+import selectors
+import sys
+import sqlite3
+import contextlib
+import copy
+from types import SimpleNamespace
+import functools
+import socket
+import ssl
+import ipaddress
+import http.client
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+import urllib3
+import urllib3.connection
+import urllib3.exceptions
+import urllib3.util.connection
+import dns.resolver
+import dns.exception
+import heapq
+import itertools
+import bisect
+import zlib
+import math
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Logging configuration
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")     # "json" (one object per line) or "text"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_RATE = float(os.environ.get("LOG_RATE", "5"))     # Records per second per message template; 0 = unlimited
+LOG_BURST = int(os.environ.get("LOG_BURST", "20"))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; fields passed with extra= become top-level keys"""
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+    
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in self.RESERVED)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} (+{suppressed} similar suppressed)" if suppressed else text
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per message template (and per server, for warnings and errors that name one), so a
+    flood of one message costs a dict lookup per record. The next record let through carries how many were dropped
+    in its suppressed field."""
+    MAX_KEYS = 16384
+    
+    def __init__(self, rate=LOG_RATE, burst=LOG_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.counter = None   # Counter incremented per dropped record, wired up with the metrics
+        self._buckets = {}    # (level, template, server or None) -> [tokens, last refill, suppressed]
+        self._lock = threading.Lock()
+    
+    def filter(self, record):
+        if self.rate <= 0:
+            return True
+        # One failing server must not hide the others behind a shared bucket; successes stay on
+        # the template's bucket so their cost doesn't grow with the ping rate
+        server = getattr(record, "server", None) if record.levelno >= logging.WARNING else None
+        key = (record.levelno, record.msg, server)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.MAX_KEYS:
+                    self._evict(now)
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                if self.counter is not None:
+                    self.counter.inc()
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed, bucket[2] = bucket[2], 0
+        return True
+    
+    def _evict(self, now):
+        """Forget buckets that have refilled with nothing pending; they would start full anyway"""
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if bucket[2] or bucket[0] + (now - bucket[1]) * self.rate < self.burst}
+        if len(self._buckets) >= self.MAX_KEYS:
+            self._buckets.clear()  # Everything is busy; never grow without bound
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue the record as is; %-formatting and the write happen on the listener thread.
+    Log arguments must not be mutated afterwards, which holds for the values logged here."""
+    def prepare(self, record):
+        return record
+
+
+log_queue = queue.SimpleQueue()
+log_output = logging.StreamHandler()
+log_output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else
+                        TextFormatter('%(asctime)s - %(levelname)s - %(message)s'))
+log_filter = RateLimitFilter()
+log_handler = LazyQueueHandler(log_queue)
+log_handler.addFilter(log_filter)
+logging.basicConfig(level=LOG_LEVEL if isinstance(logging.getLevelName(LOG_LEVEL), int) else logging.INFO,
+                    handlers=[log_handler])
+log_listener = logging.handlers.QueueListener(log_queue, log_output)
+log_listener.start()
+atexit.register(log_listener.stop)  # Drain what is queued before exiting
 logger = logging.getLogger(__name__)
+if not isinstance(logging.getLevelName(LOG_LEVEL), int):
+    logger.warning("⚠️ Unknown LOG_LEVEL %r, logging at INFO", LOG_LEVEL)
 
-# MongoDB configuration
+# Storage configuration
 MONGO_URI = os.environ.get("MONGO_URI", "mongodb+srv://your-connection-string")
 DB_NAME = "Cluster0"
 COLLECTION_NAME = "servers"
 STATS_COLLECTION = "statistics"
+LEASES_COLLECTION = "leases"
+WORKERS_COLLECTION = "workers"
+TOMBSTONES_COLLECTION = "tombstones"  # Names of deleted servers, for workers polling for changes
+# "mongo", "sqlite" or "memory"; without a MONGO_URI there is no cluster to talk to
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongo" if "MONGO_URI" in os.environ else "sqlite")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "monitor.db")
+
+# ==================== STORAGE ====================
+
+class StorageError(Exception):
+    """Raised by the local backends for unsupported queries"""
+
+
+class DuplicateKey(StorageError):
+    """A local write would break a unique index"""
+
+
+STORAGE_ERRORS = (PyMongoError, sqlite3.Error, StorageError)
+
+
+def _compare(op, value, arg):
+    try:
+        if op == "$ne":
+            return value != arg
+        if op == "$in":
+            return value in arg
+        if op == "$nin":
+            return value not in arg
+        if op == "$gt":
+            return value is not None and value > arg
+        if op == "$gte":
+            return value is not None and value >= arg
+        if op == "$lt":
+            return value is not None and value < arg
+        if op == "$lte":
+            return value is not None and value <= arg
+    except TypeError:
+        return False
+    raise StorageError(f"Unsupported query operator {op}")
+
+
+def match_document(doc, filter):
+    """Evaluate the subset of Mongo filters the app uses against a plain dict"""
+    for field, condition in (filter or {}).items():
+        if field == "$or":
+            if not any(match_document(doc, clause) for clause in condition):
+                return False
+            continue
+        value = doc.get(field)
+        # Like Mongo, a condition on an array field matches the array itself or any element
+        candidates = [value] + value if isinstance(value, list) else [value]
+        if not any(_match_value(candidate, condition, field in doc) for candidate in candidates):
+            return False
+    return True
+
+
+def _match_value(value, condition, present):
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for op, arg in condition.items():
+            if op == "$exists":
+                if present != bool(arg):
+                    return False
+            elif not _compare(op, value, arg):
+                return False
+        return True
+    return value == condition
+
+
+def apply_update(doc, update, inserting=False):
+    """Return a copy of doc with $set/$inc/$unset (and $setOnInsert on upsert) applied"""
+    doc = dict(doc)
+    for op, fields in update.items():
+        if op == "$set" or (op == "$setOnInsert" and inserting):
+            doc.update(copy.deepcopy(fields))
+        elif op == "$inc":
+            for field, amount in fields.items():
+                doc[field] = (doc.get(field) or 0) + amount
+        elif op == "$unset":
+            for field in fields:
+                doc.pop(field, None)
+        elif op != "$setOnInsert":
+            raise StorageError(f"Unsupported update operator {op}")
+    return doc
+
+
+def project_document(doc, projection):
+    if not projection:
+        return dict(doc)
+    included = [field for field, keep in projection.items() if keep and field != "_id"]
+    if included:
+        return {field: doc[field] for field in included if field in doc}
+    return {field: value for field, value in doc.items() if field not in projection}
+
+
+class DocumentCollection:
+    """Mongo-style collection API over a local key -> document store"""
+    def __init__(self, name):
+        self.name = name
+    
+    # Backends provide: _select(filter) -> [(key, doc)], _insert(docs), _replace([(key, doc)]),
+    # _delete(keys) and _transaction(), a context manager that makes a batch atomic
+    
+    def find(self, filter=None, projection=None):
+        return [project_document(doc, projection) for _, doc in self._select(filter)]
+    
+    def find_one(self, filter=None, projection=None):
+        for _, doc in self._select(filter):
+            return project_document(doc, projection)
+        return None
+    
+    def insert_one(self, doc):
+        with self._transaction():
+            self._insert([copy.deepcopy(doc)])
+        return SimpleNamespace(acknowledged=True)
+    
+    def insert_many(self, docs, ordered=True):
+        """Insert in one transaction; unique-index clashes are reported the way pymongo does"""
+        errors = []
+        inserted = 0
+        with self._transaction():
+            for index, doc in enumerate(docs):
+                try:
+                    self._insert([copy.deepcopy(doc)])
+                    inserted += 1
+                except DuplicateKey as e:
+                    errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": doc})
+                    if ordered:
+                        break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [], "nInserted": inserted,
+                "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+            })
+        return SimpleNamespace(acknowledged=True, inserted_count=inserted)
+    
+    def _update(self, filter, update, upsert, many):
+        matches = self._select(filter)
+        if not many:
+            matches = matches[:1]
+        if matches:
+            self._replace([(key, apply_update(doc, update)) for key, doc in matches])
+        elif upsert:
+            self._insert([apply_update(self._upsert_seed(filter), update, inserting=True)])
+        return SimpleNamespace(matched_count=len(matches), modified_count=len(matches), upserted=not matches and upsert)
+    
+    @staticmethod
+    def _upsert_seed(filter):
+        return {k: v for k, v in filter.items() if not k.startswith("$") and not isinstance(v, dict)}
+    
+    def find_one_and_update(self, filter, update, upsert=False, return_document=False):
+        """Atomic read-modify-write; returns the document before the update, or after it if return_document"""
+        with self._transaction():
+            matches = self._select(filter)[:1]
+            if matches:
+                key, before = matches[0]
+                after = apply_update(before, update)
+                self._replace([(key, after)])
+                return dict(after if return_document else before)
+            if upsert:
+                doc = apply_update(self._upsert_seed(filter), update, inserting=True)
+                self._insert([doc])
+                return dict(doc) if return_document else None
+            return None
+    
+    def update_one(self, filter, update, upsert=False):
+        with self._transaction():
+            return self._update(filter, update, upsert, many=False)
+    
+    def update_many(self, filter, update, upsert=False):
+        with self._transaction():
+            return self._update(filter, update, upsert, many=True)
+    
+    def bulk_update(self, updates):
+        """Apply (filter, update, upsert, many) tuples in one transaction"""
+        with self._transaction():
+            for filter, update, upsert, many in updates:
+                self._update(filter, update, upsert, many)
+    
+    def delete_one(self, filter):
+        with self._transaction():
+            keys = [key for key, _ in self._select(filter)[:1]]
+            self._delete(keys)
+        return SimpleNamespace(deleted_count=len(keys))
+    
+    def delete_many(self, filter):
+        with self._transaction():
+            keys = [key for key, _ in self._select(filter)]
+            self._delete(keys)
+        return SimpleNamespace(deleted_count=len(keys))
+    
+    def create_index(self, keys, **kwargs):
+        pass
+
+
+class MemoryCollection(DocumentCollection):
+    """Documents kept in a dict; lost on restart"""
+    def __init__(self, name):
+        super().__init__(name)
+        self._docs = {}
+        self._ids = itertools.count()
+        self._unique = {}  # indexed fields -> {values: key}
+        self._lock = threading.RLock()
+    
+    def _transaction(self):
+        return self._lock
+    
+    def _select(self, filter):
+        with self._lock:
+            return [(key, doc) for key, doc in self._docs.items() if match_document(doc, filter)]
+    
+    def _claim(self, key, old, new):
+        """Move a document's unique-index entries from old to new, refusing clashes"""
+        for fields, values in self._unique.items():
+            before = tuple(old.get(f) for f in fields) if old is not None else None
+            after = tuple(new.get(f) for f in fields)
+            if after == before:
+                continue
+            if after in values:
+                raise DuplicateKey(f"E11000 duplicate key in {self.name}: {dict(zip(fields, after))}")
+            values.pop(before, None)
+            values[after] = key
+    
+    def _insert(self, docs):
+        for doc in docs:
+            key = next(self._ids)
+            self._claim(key, None, doc)
+            self._docs[key] = doc
+    
+    def _replace(self, pairs):
+        for key, doc in pairs:
+            self._claim(key, self._docs.get(key), doc)
+            self._docs[key] = doc
+    
+    def _delete(self, keys):
+        for key in keys:
+            doc = self._docs.pop(key, None)
+            if doc is not None:
+                for fields, values in self._unique.items():
+                    values.pop(tuple(doc.get(f) for f in fields), None)
+    
+    def create_index(self, keys, unique=False, **kwargs):
+        if not unique:
+            return
+        fields = (keys,) if isinstance(keys, str) else tuple(field for field, _ in keys)
+        with self._lock:
+            values = {}
+            for key, doc in self._docs.items():
+                value = tuple(doc.get(f) for f in fields)
+                if value in values:
+                    raise DuplicateKey(f"E11000 duplicate key in {self.name}: {dict(zip(fields, value))}")
+                values[value] = key
+            self._unique[fields] = values
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _json_object(obj):
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+SQL_OPERATORS = {"$eq": "=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+SQL_ARRAY_FIELDS = {"tags"}  # $in also matches their elements, which SQL IN can't, so it stays in Python
+SQL_MAX_IN = 30000 if sqlite3.sqlite_version_info >= (3, 32) else 900  # Under the bound-parameter limit
 
-# Connect to MongoDB
-try:
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    collection = db[COLLECTION_NAME]
-    stats_collection = db[STATS_COLLECTION]
+
+def _sql_scalar(value):
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+def _json_column(field):
+    # Inline, not a bound parameter: SQLite only uses an expression index whose text matches exactly
+    return "json_extract(doc, '$.\"" + field.replace('"', '').replace("'", "''") + "\"')"
+
+
+class SqliteCollection(DocumentCollection):
+    """Documents stored as JSON rows; equality, range and $in filters on plain fields are pushed into SQL"""
+    def __init__(self, storage, name):
+        super().__init__(name)
+        self.storage = storage
+        self.table = '"' + name.replace('"', '""') + '"'
+        with storage.transaction() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (id INTEGER PRIMARY KEY, doc TEXT NOT NULL)")
+    
+    def _transaction(self):
+        # Take the write lock up front so read-modify-write is atomic across processes
+        return self.storage.transaction(immediate=True)
+    
+    def _select(self, filter):
+        clauses, args = [], []
+        for field, value in (filter or {}).items():
+            if field.startswith("$"):
+                continue
+            conditions = value.items() if isinstance(value, dict) else [("$eq", value)]
+            for op, arg in conditions:
+                if op in SQL_OPERATORS and _sql_scalar(arg):
+                    clauses.append(f"{_json_column(field)} {SQL_OPERATORS[op]} ?")
+                    args.append(arg)
+                elif (op == "$in" and field not in SQL_ARRAY_FIELDS and isinstance(arg, (list, tuple)) and arg
+                      and len(arg) <= SQL_MAX_IN and all(map(_sql_scalar, arg))):
+                    clauses.append(f"{_json_column(field)} IN ({', '.join('?' * len(arg))})")
+                    args.extend(arg)
+        sql = f"SELECT id, doc FROM {self.table}" + (" WHERE " + " AND ".join(clauses) if clauses else "")
+        with self.storage.transaction() as conn:
+            rows = conn.execute(sql, args).fetchall()
+        docs = ((key, json.loads(raw, object_hook=_json_object)) for key, raw in rows)
+        return [(key, doc) for key, doc in docs if match_document(doc, filter)]
+    
+    def _insert(self, docs):
+        try:
+            with self.storage.transaction() as conn:
+                conn.executemany(f"INSERT INTO {self.table} (doc) VALUES (?)",
+                                 [(json.dumps(doc, default=_json_default),) for doc in docs])
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKey(f"E11000 duplicate key in {self.name}: {e}") from e
+    
+    def _replace(self, pairs):
+        try:
+            with self.storage.transaction() as conn:
+                conn.executemany(f"UPDATE {self.table} SET doc = ? WHERE id = ?",
+                                 [(json.dumps(doc, default=_json_default), key) for key, doc in pairs])
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKey(f"E11000 duplicate key in {self.name}: {e}") from e
+    
+    def _delete(self, keys):
+        with self.storage.transaction() as conn:
+            conn.executemany(f"DELETE FROM {self.table} WHERE id = ?", [(key,) for key in keys])
+    
+    def create_index(self, keys, unique=False, **kwargs):
+        fields = [keys] if isinstance(keys, str) else [field for field, _ in keys]
+        index = "_".join([self.name] + fields + (["unique"] if unique else [])).replace('"', "")
+        columns = ", ".join(_json_column(field) for field in fields)
+        with self.storage.transaction() as conn:
+            conn.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS "{index}" ON {self.table} ({columns})')
+
+
+class MongoCollection:
+    """pymongo collection plus the batched update the result writer uses"""
+    def __init__(self, coll):
+        self._coll = coll
+        self.name = coll.name
+    
+    def __getattr__(self, attr):
+        return getattr(self._coll, attr)
+    
+    def bulk_update(self, updates):
+        self._coll.bulk_write([
+            (UpdateMany if many else UpdateOne)(filter, update, upsert=upsert)
+            for filter, update, upsert, many in updates
+        ], ordered=False)
+
+
+class MongoStorage:
+    def __init__(self, uri, db_name):
+        self.client = MongoClient(uri)
+        self.db = self.client[db_name]
+    
+    def collection(self, name):
+        return MongoCollection(self.db[name])
+    
+    def ping(self):
+        self.client.admin.command("ping")
+    
+    def close(self):
+        self.client.close()
+
+
+class SqliteStorage:
+    """Single-file database in WAL mode; each batch of writes is one transaction"""
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.RLock()
+        self._depth = 0
+    
+    @contextlib.contextmanager
+    def transaction(self, immediate=False):
+        """Serialise access; the outermost block commits everything nested in it"""
+        with self._lock:
+            self._depth += 1
+            if self._depth == 1:
+                self.conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield self.conn
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.conn.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self.conn.execute("COMMIT")
+    
+    def collection(self, name):
+        return SqliteCollection(self, name)
+    
+    def ping(self):
+        with self.transaction() as conn:
+            conn.execute("SELECT 1")
+    
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class MemoryStorage:
+    def __init__(self):
+        self._collections = {}
     
-    logger.info("✅ Connected to MongoDB")
-except Exception as e:
-    logger.error(f"❌ Failed to connect to MongoDB: {str(e)}")
-    raise
+    def collection(self, name):
+        return self._collections.setdefault(name, MemoryCollection(name))
+    
+    def ping(self):
+        pass
+    
+    def close(self):
+        pass
+
+
+def open_storage(backend=STORAGE_BACKEND):
+    if backend == "mongo":
+        return MongoStorage(MONGO_URI, DB_NAME)
+    if backend == "sqlite":
+        return SqliteStorage(SQLITE_PATH)
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}")
+
+
+class LazyStorage:
+    """Opens the configured backend on first use, so importing main.py never waits on the network"""
+    def __init__(self, backend):
+        self.backend = backend
+        self._storage = None
+        self._lock = threading.Lock()
+    
+    def get(self):
+        if self._storage is None:
+            with self._lock:
+                if self._storage is None:
+                    self._storage = open_storage(self.backend)
+                    logger.info("✅ Storage opened (%s)", self.backend)
+        return self._storage
+    
+    def collection(self, name):
+        return LazyCollection(self, name)
+    
+    def ping(self):
+        """Round trip to the backend; raises if it is unreachable"""
+        self.get().ping()
+    
+    def close(self):
+        if self._storage is not None:
+            self._storage.close()
+
+
+class LazyCollection:
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self._coll = None
+    
+    def __getattr__(self, attr):
+        if self._coll is None:
+            self._coll = self.storage.get().collection(self.name)
+        return getattr(self._coll, attr)
+
+
+storage = LazyStorage(STORAGE_BACKEND)
+collection = storage.collection(COLLECTION_NAME)
+stats_collection = storage.collection(STATS_COLLECTION)
+leases_collection = storage.collection(LEASES_COLLECTION)
+workers_collection = storage.collection(WORKERS_COLLECTION)
+tombstones_collection = storage.collection(TOMBSTONES_COLLECTION)
 
 # Global variables
 APP_URL = os.environ.get("RENDER_EXTERNAL_URL", "http://localhost:8000")
 START_TIME = time.time()
 
+# HTTP server configuration
+HTTP_PORT = int(os.environ.get("PORT", "8000"))
+HTTP_WORKERS = int(os.environ.get("HTTP_WORKERS", "32"))    # Connections handled concurrently
+HTTP_TIMEOUT = int(os.environ.get("HTTP_TIMEOUT", "10"))    # Per-connection read / keep-alive idle timeout
+SSE_MAX_BUFFER = 512 * 1024   # A dashboard further behind than this is dropped and resyncs on reconnect
+SSE_KEEPALIVE = 15            # Comment line so proxies keep idle streams open
+SSE_STATS_INTERVAL = 10       # Push /api/stats to connected dashboards
+
+# Keep-alive configuration
+SLEEP_THRESHOLD = int(os.environ.get("SLEEP_THRESHOLD", "10"))  # Idle seconds before generating activity
+
+# Ping engine configuration
+PING_CONCURRENCY = int(os.environ.get("PING_CONCURRENCY", "50"))      # Max pings in flight
+PING_PER_HOST_LIMIT = int(os.environ.get("PING_PER_HOST_LIMIT", "4"))  # Max pings in flight per host
+PING_TIMEOUT = 20
+PING_TIMING_MODE = os.environ.get("PING_TIMING_MODE", "total")  # "total" or "breakdown"
+PING_CHECK_MODE = os.environ.get("PING_CHECK_MODE", "headers")  # "headers", "head" or "probe"
+PROBE_BYTES = int(os.environ.get("PROBE_BYTES", "1024"))        # Body bytes read by content probes
+DRAIN_LIMIT = 4096  # Bodies up to this size are drained so the connection can be reused
+CHECK_MODES = ("headers", "head", "probe")
+
+# DNS cache for ping targets
+DNS_CACHE = os.environ.get("DNS_CACHE", "1") == "1"               # "0" resolves every connection again
+DNS_MIN_TTL = 5
+DNS_MAX_TTL = 3600
+DNS_NEGATIVE_TTL = float(os.environ.get("DNS_NEGATIVE_TTL", "30"))  # Remember NXDOMAIN this long
+DNS_FALLBACK_TTL = 60     # System resolver answers carry no TTL
+DNS_PREFETCH_RATIO = 0.1  # Refresh in the background once this fraction of the TTL is left
+DNS_CACHE_SIZE = 10000
+
+# Coalescing: servers sharing a URL and check config share one check
+PING_COALESCE = os.environ.get("PING_COALESCE", "1") == "1"
+COALESCE_WINDOW = float(os.environ.get("COALESCE_WINDOW", "30"))  # Pull group members due this soon into the check
+
+# Circuit breaker: back off from targets that keep failing
+BREAKER_THRESHOLD = int(os.environ.get("BREAKER_THRESHOLD", "3"))            # Consecutive failures that open it
+BREAKER_BASE_DELAY = float(os.environ.get("BREAKER_BASE_DELAY", "60"))       # First open period, doubled per failure
+BREAKER_MAX_DELAY = float(os.environ.get("BREAKER_MAX_DELAY", "3600"))
+# Adaptive timeouts: a multiple of each server's observed p99, within [min, PING_TIMEOUT]
+TIMEOUT_P99_FACTOR = float(os.environ.get("TIMEOUT_P99_FACTOR", "3"))
+TIMEOUT_MIN = float(os.environ.get("TIMEOUT_MIN", "2"))
+TIMEOUT_MIN_SAMPLES = 20
+
+# Result writer configuration
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", "500"))           # Flush when this many docs are dirty
+WRITE_FLUSH_INTERVAL = float(os.environ.get("WRITE_FLUSH_INTERVAL", "2"))   # ...or after this many seconds
+WRITE_MAX_PENDING = int(os.environ.get("WRITE_MAX_PENDING", "20000"))       # Submitters block beyond this
+
+# Scheduler configuration
+DEFAULT_PING_INTERVAL = int(os.environ.get("DEFAULT_PING_INTERVAL", "300"))          # 5 minutes
+MIN_PING_INTERVAL = int(os.environ.get("MIN_PING_INTERVAL", "10"))
+REGISTRY_REFRESH_INTERVAL = int(os.environ.get("REGISTRY_REFRESH_INTERVAL", "5"))  # Poll for config changes
+REGISTRY_CHANGE_STREAMS = os.environ.get("REGISTRY_CHANGE_STREAMS", "1") == "1"   # Watch Mongo instead of polling
+WATERMARK_SLACK = 5            # Re-read changes this far behind the watermark; commits land out of order
+TOMBSTONE_RETENTION = 86400    # Workers further behind than this reload everything instead
+REGISTRY_RECONCILE_INTERVAL = int(os.environ.get("REGISTRY_RECONCILE_INTERVAL", "600"))  # Names-only check for deletes made outside the app
+CONFIG_FIELDS = ("url", "email", "password", "interval", "check_mode", "expect", "tags", "paused")  # Owned by the database
+# Stored state a restart resumes from: the schedule (last_ping), circuit breakers, dashboard counters, uptime windows
+RESUME_FIELDS = ("status", "last_ping", "consecutive_failures", "total_pings", "successful_pings", "failed_pings",
+                 "response_time", "latency_p50", "latency_p95", "latency_p99", "uptime_buckets")
+# Shown on the dashboard; for servers another worker pings they come from storage (pinged_at is their watermark)
+RESULT_FIELDS = ("status_code", "error", "pinged_at")
+REGISTRY_PROJECTION = dict.fromkeys(("name", "updated_at") + CONFIG_FIELDS + RESUME_FIELDS + RESULT_FIELDS, 1)
+# Changed documents only need uptime_buckets if new, and a new server has none yet
+POLL_PROJECTION = dict({f: 1 for f in REGISTRY_PROJECTION if f != "uptime_buckets"}, _id=0)
+# What a ping changes, less uptime_buckets: windows are live-only and stay with the worker that pings
+STORED_RESULT_FIELDS = tuple(f for f in RESUME_FIELDS if f != "uptime_buckets") + RESULT_FIELDS
+RESULTS_PROJECTION = dict(dict.fromkeys(("name",) + STORED_RESULT_FIELDS, 1), _id=0)
+MAX_PAGE_SIZE = 1000
+MAX_ADD_SERVERS = int(os.environ.get("MAX_ADD_SERVERS", "10000"))  # Entries accepted by one /add request
+
+# Latency history configuration
+HISTORY_RAW_SAMPLES = int(os.environ.get("HISTORY_RAW_SAMPLES", "720"))  # Raw samples kept per server
+ROLLUP_LEVELS = (
+    # (name, bucket width in seconds, retention in seconds)
+    ("1m", 60, 24 * 3600),
+    ("1h", 3600, 30 * 24 * 3600),
+    ("1d", 86400, 365 * 24 * 3600),
+)
+# Sharding: workers split the fleet by leasing shards of crc32(name)
+WEB_PINGS = os.environ.get("WEB_PINGS", "1") == "1"  # 0: the web process only serves the dashboard and --worker processes ping
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "64"))
+LEASE_TTL = float(os.environ.get("LEASE_TTL", "30"))                        # Unrenewed leases expire after this
+LEASE_RENEW_INTERVAL = float(os.environ.get("LEASE_RENEW_INTERVAL", "10"))  # Heartbeat and rebalance period
+SKETCH_SNAPSHOT_INTERVAL = int(os.environ.get("SKETCH_SNAPSHOT_INTERVAL", "60"))  # Share fleet sketch with other nodes
+NODE_ID = os.environ.get("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+UPTIME_WINDOWS = (
+    # (name, window in seconds, bucket width in seconds)
+    ("1h", 3600, 60),
+    ("24h", 86400, 900),
+    ("7d", 7 * 86400, 3600),
+    ("30d", 30 * 86400, 6 * 3600),
+)
+UPTIME_SNAPSHOT_INTERVAL = int(os.environ.get("UPTIME_SNAPSHOT_INTERVAL", "300"))
+HISTORY_RANGES = {"1h": 3600, "24h": 86400, "7d": 7 * 86400, "30d": 30 * 86400, "365d": 365 * 86400}
+
 # Fake user-agents
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36",
@@ -48,226 +738,2537 @@ USER_AGENTS = [
     "UptimeRobot/2.0 (http://uptimerobot.com/)",
 ]
 
-# ==================== ULTIMATE KEEP-ALIVE SYSTEM ====================
+# ==================== METRICS ====================
 
-class SelfPinger:
-    """Self-ping to keep Render app alive"""
-    def __init__(self, app_url, interval=0.1):
-        self.app_url = app_url
-        self.interval = interval
-        self.is_running = False
-        self.ping_count = 0
+class _Shards:
+    """Per-thread value cells; writers never contend, the scraper sums them"""
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
     
-    def start(self):
-        self.is_running = True
-        thread = threading.Thread(target=self._ping_loop, daemon=True)
-        thread.start()
-        logger.info("🔄 Self-Ping System Started")
+    def mine(self):
+        cells = getattr(self._local, "cells", None)
+        if cells is None:
+            cells = self._local.cells = [0] * self.size
+            with self._lock:
+                self._all.append(cells)
+        return cells
     
-    def _ping_loop(self):
-        while self.is_running:
-            try:
-                response = requests.get(
-                    f"{self.app_url}/heartbeat",
-                    timeout=10,
-                    headers={"User-Agent": "SelfPinger/1.0"}
-                )
-                self.ping_count += 1
-                logger.info(f"💓 Self-Ping #{self.ping_count}: {response.status_code}")
-                
-                # Update stats
-                stats_collection.update_one(
-                    {"type": "self_ping"},
-                    {
-                        "$set": {"last_ping": datetime.now()},
-                        "$inc": {"count": 1}
-                    },
-                    upsert=True
-                )
-            except Exception as e:
-                logger.error(f"❌ Self-Ping Failed: {e}")
-            
-            time.sleep(self.interval)
+    def total(self):
+        with self._lock:
+            shards = list(self._all)
+        return [sum(values) for values in zip(*shards)] if shards else [0] * self.size
 
 
-class ActivitySimulator:
-    """Simulate activity to prevent sleep"""
+class Metric:
+    """Base for metrics with optional labels; children are created once and cached"""
+    type = "untyped"
+    
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+    
+    def labels(self, **values):
+        key = tuple(str(values[label]) for label in self.label_names)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+    
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class _Value:
+    """Labelled counter/gauge child backed by one per-thread cell"""
     def __init__(self):
-        self.activities = [
-            self._db_query,
-            self._memory_check,
-            self._file_activity,
-        ]
-        self.is_running = False
+        self.shards = _Shards(1)
     
-    def start(self):
-        self.is_running = True
-        thread = threading.Thread(target=self._activity_loop, daemon=True)
-        thread.start()
-        logger.info("🎮 Activity Simulator Started")
+    def inc(self, amount=1):
+        self.shards.mine()[0] += amount
     
-    def _activity_loop(self):
-        while self.is_running:
-            try:
-                activity = random.choice(self.activities)
-                activity()
-                time.sleep(random.randint(0.0001, 0.0002))  # 3-5 minutes
-            except Exception as e:
-                logger.error(f"Activity error: {e}")
+    def dec(self, amount=1):
+        self.shards.mine()[0] -= amount
+
+
+class Counter(Metric):
+    type = "counter"
     
-    def _db_query(self):
-        """Database keepalive query"""
-        collection.find_one({"name": {"$exists": True}})
-        logger.info("💾 DB Keepalive Query")
+    def _new_child(self):
+        return _Value()
     
-    def _memory_check(self):
-        """Memory usage check"""
-        memory = psutil.virtual_memory().percent
-        logger.info(f"🧠 Memory Usage: {memory}%")
+    def inc(self, amount=1):
+        self.labels().inc(amount)
     
-    def _file_activity(self):
-        """File system activity"""
-        with open('/tmp/keepalive.txt', 'w') as f:
-            f.write(str(time.time()))
-        logger.info("📁 File Activity")
+    def _render_child(self, key, child):
+        return [f"{self.name}{self._label_text(key)} {child.shards.total()[0]}"]
 
 
-class SleepPrevention:
-    """Prevent Render from sleeping"""
+class Gauge(Metric):
+    """Current value, read from a callback at scrape time or tracked with inc/dec"""
+    type = "gauge"
+    
+    def __init__(self, name, help, labels=(), function=None):
+        super().__init__(name, help, labels)
+        self.function = function
+    
+    def _new_child(self):
+        return _Value()
+    
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+    
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+    
+    def render(self):
+        if self.function is None:
+            return super().render()
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}",
+                f"{self.name} {self.function()}"]
+    
+    def _render_child(self, key, child):
+        return [f"{self.name}{self._label_text(key)} {child.shards.total()[0]}"]
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.shards = _Shards(len(buckets) + 3)  # bucket counts incl. +Inf, sum, count
+    
+    def observe(self, value):
+        cells = self.shards.mine()
+        cells[bisect.bisect_left(self.buckets, value)] += 1
+        cells[-2] += value
+        cells[-1] += 1
+
+
+class Histogram(Metric):
+    type = "histogram"
+    
+    def __init__(self, name, help, labels=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+    
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+    
+    def observe(self, value):
+        self.labels().observe(value)
+    
+    def _render_child(self, key, child):
+        totals = child.shards.total()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), totals):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else repr(float(bound))
+            lines.append(f"{self.name}_bucket{self._label_text(key, [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {totals[-2]}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {totals[-1]}")
+        return lines
+
+
+class MetricsRegistry:
     def __init__(self):
-        self.last_activity = time.time()
-        self.sleep_threshold = 10  # 14 minutes
-        self.is_running = False
+        self.metrics = []
+    
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+    
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+PING_DURATION = metrics.add(Histogram(
+    "monitor_ping_duration_seconds", "Duration of outbound health checks", ["result"]))
+SCHEDULER_LAG = metrics.add(Histogram(
+    "monitor_scheduler_lag_seconds", "Delay between a server's due time and its ping starting",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 15, 30, 60)))
+DB_WRITE_DURATION = metrics.add(Histogram(
+    "monitor_db_write_duration_seconds", "Duration of bulk_write flushes", ["collection"]))
+DB_WRITE_BATCH = metrics.add(Histogram(
+    "monitor_db_write_batch_size", "Documents per bulk_write flush", ["collection"],
+    buckets=(1, 5, 10, 50, 100, 500, 1000, 5000)))
+HTTP_DURATION = metrics.add(Histogram(
+    "monitor_http_request_duration_seconds", "Dashboard / API handler latency", ["method", "route"]))
+COMPONENT_ITERATIONS = metrics.add(Counter(
+    "monitor_component_iterations_total", "Wake-ups of keep-alive components", ["component"]))
+DNS_LOOKUPS = metrics.add(Histogram(
+    "monitor_dns_lookup_seconds", "Hostname resolution time for ping targets", ["result"],
+    buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)))
+LOG_SUPPRESSED = metrics.add(Counter(
+    "monitor_log_records_suppressed_total", "Log records dropped by the per-template rate limit"))
+log_filter.counter = LOG_SUPPRESSED
+HTTP_ROUTES = {
+    "/", "/heartbeat", "/ready", "/metrics", "/api/servers", "/api/stats", "/api/history", "/api/events",
+    "/add", "/remove", "/remove-by-url", "/manage",
+}
+
+# ==================== HTTP CLIENT ====================
+
+# getaddrinfo errors that mean the name does not exist, as opposed to a resolver that failed to answer
+NEGATIVE_ERRNOS = {socket.EAI_NONAME} | ({socket.EAI_NODATA} if hasattr(socket, "EAI_NODATA") else set())
+
+
+class DnsCache:
+    """Shared resolver cache that honours record TTLs, remembers failures and refreshes hot names early"""
+    def __init__(self, enabled=DNS_CACHE, negative_ttl=DNS_NEGATIVE_TTL, prefetch_ratio=DNS_PREFETCH_RATIO,
+                 max_entries=DNS_CACHE_SIZE):
+        self.enabled = enabled
+        self.negative_ttl = negative_ttl
+        self.prefetch_ratio = prefetch_ratio
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.prefetches = 0
+        self._entries = {}  # host -> (addresses, expires at, ttl); no addresses means NXDOMAIN
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="dns")
+        try:
+            self.resolver = dns.resolver.Resolver()
+            self.resolver.lifetime = 5
+        except dns.exception.DNSException:
+            self.resolver = None  # No resolv.conf: the system resolver does everything
+    
+    def resolve(self, host):
+        """Addresses for host, most preferred first; raises socket.gaierror like getaddrinfo"""
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        if not self.enabled:
+            return self._system(host)[0]
+        
+        now = time.monotonic()
+        entry = self._entries.get(host)
+        if entry is not None and entry[1] > now:
+            addresses, expires, ttl = entry
+            if not addresses:
+                self.negative_hits += 1
+                DNS_LOOKUPS.labels(result="negative").observe(0)
+                raise socket.gaierror(socket.EAI_NONAME, f"{host}: name not known (cached)")
+            self.hits += 1
+            DNS_LOOKUPS.labels(result="hit").observe(0)
+            if expires - now < ttl * self.prefetch_ratio:
+                self._prefetch(host)
+            return addresses
+        
+        self.misses += 1
+        start = time.perf_counter()
+        try:
+            addresses, ttl = self._query(host)
+        except socket.gaierror as e:
+            # Only a definite "no such name" is remembered; timeouts and EAI_AGAIN retry on the next check
+            if e.errno in NEGATIVE_ERRNOS:
+                self._store(host, [], self.negative_ttl)
+            raise
+        finally:
+            DNS_LOOKUPS.labels(result="miss").observe(time.perf_counter() - start)
+        self._store(host, addresses, ttl)
+        return addresses
+    
+    def _store(self, host, addresses, ttl):
+        now = time.monotonic()
+        ttl = min(max(ttl, DNS_MIN_TTL), DNS_MAX_TTL)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {h: e for h, e in self._entries.items() if e[1] > now}
+            self._entries[host] = (addresses, now + ttl, ttl)
+    
+    def _prefetch(self, host):
+        with self._lock:
+            if host in self._refreshing:
+                return
+            self._refreshing.add(host)
+        self.prefetches += 1
+        self._executor.submit(self._refresh, host)
+    
+    def _refresh(self, host):
+        try:
+            self._store(host, *self._query(host))
+        except (socket.gaierror, OSError):
+            pass  # Keep serving the current answer until it expires
+        finally:
+            with self._lock:
+                self._refreshing.discard(host)
+    
+    def _query(self, host):
+        """(addresses, ttl) from DNS, falling back to the system resolver for hosts files and outages"""
+        if self.resolver is not None:
+            try:
+                for rdtype in ("A", "AAAA"):
+                    try:
+                        answer = self.resolver.resolve(host, rdtype)
+                    except dns.resolver.NoAnswer:
+                        continue
+                    return [record.address for record in answer], answer.rrset.ttl
+            except dns.resolver.NXDOMAIN:
+                try:
+                    return self._system(host)  # Still honour the hosts file
+                except socket.gaierror:
+                    raise socket.gaierror(socket.EAI_NONAME, f"{host}: name not known") from None
+            except dns.exception.DNSException:
+                pass
+        return self._system(host)
+    
+    @staticmethod
+    def _system(host):
+        infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        return list(dict.fromkeys(info[4][0] for info in infos)), DNS_FALLBACK_TTL
+    
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "prefetches": self.prefetches,
+        }
+
+
+dns_cache = DnsCache()
+
+
+def cached_create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None,
+                             socket_options=None):
+    """urllib3's create_connection, resolving through dns_cache and trying each address in turn"""
+    host, port = address
+    error = None
+    for ip in dns_cache.resolve(host.strip("[]")):
+        try:
+            return urllib3.util.connection.create_connection((ip, port), timeout, source_address, socket_options)
+        except OSError as e:
+            error = e
+    raise error
+
+
+class _CachedDnsConnection:
+    """urllib3 connection whose _new_conn resolves through dns_cache; errors map as in urllib3"""
+    def _new_conn(self):
+        try:
+            return cached_create_connection((self._dns_host, self.port), self.timeout,
+                                            source_address=self.source_address, socket_options=self.socket_options)
+        except socket.gaierror as e:
+            raise urllib3.exceptions.NameResolutionError(self.host, self, e) from e
+        except socket.timeout as e:
+            raise urllib3.exceptions.ConnectTimeoutError(
+                self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})") from e
+        except OSError as e:
+            raise urllib3.exceptions.NewConnectionError(self, f"Failed to establish a new connection: {e}") from e
+
+
+class CachedDnsHTTPConnection(_CachedDnsConnection, urllib3.connection.HTTPConnection):
+    pass
+
+
+class CachedDnsHTTPSConnection(_CachedDnsConnection, urllib3.connection.HTTPSConnection):
+    pass
+
+
+class CachedDnsHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = CachedDnsHTTPConnection
+
+
+class CachedDnsHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = CachedDnsHTTPSConnection
+
+
+class CachedDnsAdapter(HTTPAdapter):
+    """Requests adapter whose pools resolve through dns_cache; only sessions that mount it are affected"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CachedDnsHTTPConnectionPool,
+            "https": CachedDnsHTTPSConnectionPool,
+        }
+
+
+def create_http_session(pool_connections=PING_CONCURRENCY, pool_maxsize=PING_PER_HOST_LIMIT):
+    """Shared keep-alive session; one pool per host, sized to the ping concurrency, resolving through dns_cache"""
+    session = requests.Session()
+    adapter = CachedDnsAdapter(pool_connections=pool_connections, pool_maxsize=max(pool_maxsize, 1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Health checks must not carry cookies from one target to the next
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+http_session = create_http_session()
+
+
+class ContentCheckError(requests.exceptions.RequestException):
+    """The response did not contain the expected content"""
+
+
+def timed_request(method, url, headers, timeout, read_bytes=0):
+    """Request over a fresh connection, timing each phase separately (in ms)"""
+    parsed = urlparse(url)
+    https = parsed.scheme == "https"
+    host = parsed.hostname
+    port = parsed.port or (443 if https else 80)
+    path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+    
+    start = time.perf_counter()
+    addresses = dns_cache.resolve(host)
+    resolved = time.perf_counter()
+    sock = cached_create_connection((addresses[0], port), timeout)
+    connected = time.perf_counter()
+    try:
+        if https:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+            conn = http.client.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        handshaken = time.perf_counter()
+        conn.sock = sock
+        conn.request(method, path, headers=headers)
+        response = conn.getresponse()
+        first_byte = time.perf_counter()
+        chunk = response.read(read_bytes) if read_bytes else b""
+        done = time.perf_counter()
+    finally:
+        sock.close()
+    
+    timings = {
+        "dns": round((resolved - start) * 1000, 2),
+        "connect": round((connected - resolved) * 1000, 2),
+        "tls": round((handshaken - connected) * 1000, 2) if https else 0,
+        "ttfb": round((first_byte - handshaken) * 1000, 2),
+        "total": round((done - start) * 1000, 2),
+    }
+    return response.status, timings, chunk
+
+
+def pooled_request(method, url, headers, timeout, read_bytes=0):
+    """Streamed request on the shared session; reads at most read_bytes of the body"""
+    response = http_session.request(
+        method, url, headers=headers, timeout=timeout, stream=True, allow_redirects=True
+    )
+    try:
+        chunk = response.raw.read(read_bytes, decode_content=True) if read_bytes else b""
+        length = response.headers.get("Content-Length", "")
+        if length.isdigit() and int(length) <= DRAIN_LIMIT:
+            # Small body: finish it so the connection goes back to the pool
+            response.raw.read(decode_content=False)
+    finally:
+        response.close()
+    return response.status_code, chunk
+
+
+def check_url(url, headers, timeout, check_mode=PING_CHECK_MODE, expect=None, timing_mode=PING_TIMING_MODE):
+    """Run one health check without downloading the body. Returns (status, timings, content_hash)"""
+    probe = check_mode == "probe" or bool(expect)
+    read_bytes = PROBE_BYTES if probe else 0
+    method = "HEAD" if check_mode == "head" and not probe else "GET"
+    
+    request = timed_request if timing_mode == "breakdown" else pooled_request
+    result = request(method, url, headers, timeout, read_bytes)
+    if method == "HEAD" and result[0] in (405, 501):
+        # Target doesn't allow HEAD; a header-only GET costs the same
+        result = request("GET", url, headers, timeout, read_bytes)
+    
+    if request is timed_request:
+        status_code, timings, chunk = result
+    else:
+        (status_code, chunk), timings = result, None
+    
+    content_hash = None
+    if probe:
+        content_hash = hashlib.sha256(chunk).hexdigest()
+        if expect and expect.encode() not in chunk:
+            raise ContentCheckError(f"Expected content {expect!r} not found in first {PROBE_BYTES} bytes")
+    return status_code, timings, content_hash
+
+
+# ==================== DATABASE WRITES ====================
+
+class ResultWriter:
+    """Buffer document updates and flush them with unordered bulk_write"""
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL,
+                 max_pending=WRITE_MAX_PENDING):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.is_running = False
+        self.submitted = 0
+        self.written = 0
+        self.flushes = 0
+        self.errors = 0
+        self._pending = {}  # (collection name, filter) -> merged update
+        self._cond = threading.Condition()
+    
+    def start(self):
+        self.is_running = True
+        thread = threading.Thread(target=self._flush_loop, daemon=True)
+        thread.start()
+        logger.info("📝 Result Writer Started")
+    
+    def submit(self, coll, filter, update, upsert=False, many=False):
+        """Queue an update; updates to the same document (or set of documents) are merged until the next flush"""
+        key = (coll.name, json.dumps(filter, sort_keys=True, default=str), many)
+        with self._cond:
+            # Backpressure: hold the caller until a flush makes room
+            while key not in self._pending and len(self._pending) >= self.max_pending:
+                self._cond.wait()
+            
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = {
+                    "coll": coll, "filter": filter, "set": {}, "inc": {}, "upsert": upsert, "many": many
+                }
+            entry["upsert"] = entry["upsert"] or upsert
+            
+            # Apply in order: a $set overrides earlier increments, an $inc adds to an earlier $set
+            for field, value in update.get("$set", {}).items():
+                entry["set"][field] = value
+                entry["inc"].pop(field, None)
+            for field, value in update.get("$inc", {}).items():
+                if field in entry["set"]:
+                    entry["set"][field] += value
+                else:
+                    entry["inc"][field] = entry["inc"].get(field, 0) + value
+            
+            self.submitted += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+    
+    def _flush_loop(self):
+        while self.is_running:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            self.flush()
+    
+    def flush(self):
+        """Write everything buffered so far"""
+        with self._cond:
+            pending, self._pending = self._pending, {}
+            self._cond.notify_all()
+        if not pending:
+            return
+        
+        batches = defaultdict(list)
+        for entry in pending.values():
+            update = {}
+            if entry["set"]:
+                update["$set"] = entry["set"]
+            if entry["inc"]:
+                update["$inc"] = entry["inc"]
+            batches[entry["coll"].name].append(
+                (entry["coll"], (entry["filter"], update, entry["upsert"], entry["many"]))
+            )
+        
+        for ops in batches.values():
+            coll = ops[0][0]
+            start = time.perf_counter()
+            try:
+                coll.bulk_update([op for _, op in ops])
+                DB_WRITE_DURATION.labels(collection=coll.name).observe(time.perf_counter() - start)
+                DB_WRITE_BATCH.labels(collection=coll.name).observe(len(ops))
+                self.written += len(ops)
+            except STORAGE_ERRORS as e:
+                self.errors += 1
+                logger.error("❌ Bulk write of %d update(s) to %s failed: %s", len(ops), coll.name, e)
+        self.flushes += 1
+
+
+result_writer = ResultWriter()
+
+# ==================== ULTIMATE KEEP-ALIVE SYSTEM ====================
+
+class TimerService:
+    """Single thread that fires registered callbacks at their deadlines"""
+    def __init__(self, workers=2):
+        self.is_running = False
+        self.wakeups = 0
+        self._heap = []  # (due, seq, callback)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        # Callbacks may block on the network; run them off the timer thread
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="timer")
+    
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        logger.info("⏰ Timer Service Started")
+    
+    def call_later(self, delay, callback):
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + max(delay, 0), next(self._seq), callback))
+            self._cond.notify()
+    
+    def _run(self):
+        while self.is_running:
+            with self._cond:
+                now = time.monotonic()
+                while not self._heap or self._heap[0][0] > now:
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+                    now = time.monotonic()
+                _, _, callback = heapq.heappop(self._heap)
+                self.wakeups += 1
+            try:
+                self._executor.submit(self._fire, callback)
+            except RuntimeError:
+                return  # Interpreter is shutting down
+    
+    def _fire(self, callback):
+        try:
+            callback()
+        except Exception as e:
+            logger.error("❌ Timer callback %s failed: %s", getattr(callback, '__qualname__', callback), e)
+
+
+timer_service = TimerService()
+metrics.add(Gauge("monitor_timer_wakeups", "Wake-ups of the shared timer thread", function=lambda: timer_service.wakeups))
+
+
+class SelfPinger:
+    """Self-ping to keep Render app alive"""
+    def __init__(self, app_url, interval=0.1, timers=timer_service):
+        self.app_url = app_url
+        self.interval = interval
+        self.timers = timers
+        self.is_running = False
+        self.ping_count = 0
+    
+    def start(self):
+        self.is_running = True
+        self.timers.call_later(0, self._ping)
+        logger.info("🔄 Self-Ping System Started")
+    
+    def _ping(self):
+        if not self.is_running:
+            return
+        COMPONENT_ITERATIONS.labels(component="self_pinger").inc()
+        try:
+            response = http_session.get(
+                f"{self.app_url}/heartbeat",
+                timeout=10,
+                headers={"User-Agent": "SelfPinger/1.0"}
+            )
+            self.ping_count += 1
+            logger.info("💓 Self-Ping #%d: %s", self.ping_count, response.status_code)
+            
+            # Update stats
+            result_writer.submit(
+                stats_collection,
+                {"type": "self_ping"},
+                {
+                    "$set": {"last_ping": datetime.now()},
+                    "$inc": {"count": 1}
+                },
+                upsert=True
+            )
+        except Exception as e:
+            logger.error("❌ Self-Ping Failed: %s", e)
+        finally:
+            self.timers.call_later(self.interval, self._ping)
+
+
+class ActivitySimulator:
+    """Simulate activity to prevent sleep"""
+    def __init__(self, min_interval=180, max_interval=300, timers=timer_service):
+        self.activities = [
+            self._db_query,
+            self._memory_check,
+            self._file_activity,
+        ]
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timers = timers
+        self.is_running = False
+    
+    def start(self):
+        self.is_running = True
+        self.timers.call_later(self._next_delay(), self._activity)
+        logger.info("🎮 Activity Simulator Started")
+    
+    def _next_delay(self):
+        return random.uniform(self.min_interval, self.max_interval)  # 3-5 minutes
+    
+    def _activity(self):
+        if not self.is_running:
+            return
+        COMPONENT_ITERATIONS.labels(component="activity_simulator").inc()
+        try:
+            activity = random.choice(self.activities)
+            activity()
+        except Exception as e:
+            logger.error("Activity error: %s", e)
+        finally:
+            self.timers.call_later(self._next_delay(), self._activity)
+    
+    def _db_query(self):
+        """Database keepalive query"""
+        collection.find_one({"name": {"$exists": True}})
+        logger.info("💾 DB Keepalive Query")
+    
+    def _memory_check(self):
+        """Memory usage check"""
+        memory = psutil.virtual_memory().percent
+        logger.info("🧠 Memory Usage: %s%%", memory)
+    
+    def _file_activity(self):
+        """File system activity"""
+        with open('/tmp/keepalive.txt', 'w') as f:
+            f.write(str(time.time()))
+        logger.info("📁 File Activity")
+
+
+class SleepPrevention:
+    """Prevent Render from sleeping"""
+    def __init__(self, sleep_threshold=SLEEP_THRESHOLD, timers=timer_service):
+        self.last_activity = time.time()
+        self.sleep_threshold = sleep_threshold
+        self.timers = timers
+        self.is_running = False
+    
+    def start(self):
+        self.is_running = True
+        self._arm()
+        logger.info("😴 Sleep Prevention Started")
+    
+    def _arm(self):
+        """Wake up exactly when the idle threshold would be crossed"""
+        delay = self.last_activity + self.sleep_threshold - time.time()
+        if delay <= 0:
+            delay = self.sleep_threshold  # Last attempt failed; retry after another threshold
+        self.timers.call_later(delay, self._check)
+    
+    def _check(self):
+        if not self.is_running:
+            return
+        COMPONENT_ITERATIONS.labels(component="sleep_prevention").inc()
+        try:
+            idle_time = time.time() - self.last_activity
+            
+            if idle_time >= self.sleep_threshold:
+                logger.warning("⚠️ Idle for %ds - Generating Activity!", idle_time)
+                self._generate_activity()
+        finally:
+            self._arm()
+    
+    def _generate_activity(self):
+        try:
+            http_session.get(f"http://localhost:{HTTP_PORT}/heartbeat", timeout=2)
+            self.update_activity()
+            logger.info("✅ Activity Generated - Sleep Prevented")
+        except:
+            pass
+    
+    def update_activity(self):
+        # Cheap on purpose: called on every request, the next check re-arms from here
+        self.last_activity = time.time()
+
+
+class UltimateKeepAlive:
+    """Main Keep-Alive orchestrator"""
+    def __init__(self, app_url, timers=timer_service):
+        self.app_url = app_url
+        self.timers = timers
+        
+        # Add components; they all share one timer thread
+        self.self_pinger = SelfPinger(self.app_url, interval=240, timers=timers)
+        self.activity_sim = ActivitySimulator(timers=timers)
+        self.sleep_prev = SleepPrevention(timers=timers)
+        self.components = [self.self_pinger, self.activity_sim, self.sleep_prev]
+        
+    def setup(self):
+        logger.info("🚀 Initializing Ultimate Keep-Alive System...")
+        
+        # Start all components
+        self.timers.start()
+        self.self_pinger.start()
+        self.activity_sim.start()
+        self.sleep_prev.start()
+        
+        logger.info("✅ Ultimate Keep-Alive System Activated!")
+        logger.info("📍 App URL: %s", self.app_url)
+        logger.info("⏱️  Self-Ping Interval: %s Seconds", self.self_pinger.interval)
+        logger.info("🎯 Sleep Threshold: %s Seconds", self.sleep_prev.sleep_threshold)
+
+
+keep_alive = UltimateKeepAlive(APP_URL)
+
+# ==================== SERVER REGISTRY ====================
+
+class ServerRegistry:
+    """In-process server state, updated by the ping engine and served to the API"""
+    def __init__(self):
+        self.version = 0
+        self._servers = {}
+        self._names = []                     # Sorted; backs cursors and name prefixes
+        self._by_status = defaultdict(set)
+        self._by_url = defaultdict(set)
+        self._lock = threading.Lock()
+        self._encoded = None  # (version, body, etag)
+        self.listeners = []   # Called with (event, data) for every change
+    
+    def _changed(self):
+        self.version += 1
+    
+    def _emit(self, event, data):
+        for listener in self.listeners:
+            listener(event, data)
+    
+    def _index(self, server):
+        self._by_status[server.get("status")].add(server["name"])
+        self._by_url[server.get("url")].add(server["name"])
+    
+    def _unindex(self, server):
+        for index, key in ((self._by_status, server.get("status")), (self._by_url, server.get("url"))):
+            names = index.get(key)
+            if names is not None:
+                names.discard(server["name"])
+                if not names:
+                    del index[key]
+    
+    def _insert(self, doc):
+        name = doc["name"]
+        current = self._servers.get(name)
+        if current is not None:
+            self._unindex(current)
+        else:
+            bisect.insort(self._names, name)
+        self._servers[name] = doc
+        self._index(doc)
+        self._changed()
+        self._emit("server", self.public(doc))
+    
+    def _delete(self, name):
+        server = self._servers.pop(name, None)
+        if server is None:
+            return False
+        self._unindex(server)
+        del self._names[bisect.bisect_left(self._names, name)]
+        self._changed()
+        self._emit("removed", {"name": name})
+        return True
+    
+    def _merge(self, doc, stored_results=False):
+        doc.pop("_id", None)
+        current = self._servers.get(doc["name"])
+        if current is None:
+            self._insert(doc)
+            return
+        fields = CONFIG_FIELDS + ("updated_at",) + (STORED_RESULT_FIELDS if stored_results else ())
+        changed = {f: doc.get(f) for f in fields if current.get(f) != doc.get(f)}
+        if changed:
+            self._insert({**current, **changed})
+    
+    def merge_results(self, docs):
+        """Take stored ping results for servers already in the registry; never adds one"""
+        with self._lock:
+            for doc in docs:
+                current = self._servers.get(doc["name"])
+                if current is None:
+                    continue
+                changed = {f: doc.get(f) for f in STORED_RESULT_FIELDS if current.get(f) != doc.get(f)}
+                if changed:
+                    self._insert({**current, **changed})
+    
+    def sync(self, docs, remote=None):
+        """Merge a database snapshot; live ping results win over stored ones, except for the
+        servers remote(name) says another worker pings"""
+        with self._lock:
+            names = set()
+            for doc in docs:
+                names.add(doc["name"])
+                self._merge(doc, bool(remote and remote(doc["name"])))
+            for name in set(self._servers) - names:
+                self._delete(name)
+    
+    def merge(self, docs, remote=None):
+        """Merge changed documents without touching the rest of the registry"""
+        with self._lock:
+            for doc in docs:
+                self._merge(doc, bool(remote and remote(doc["name"])))
+    
+    def add(self, doc):
+        with self._lock:
+            self._insert({k: v for k, v in doc.items() if k != "_id"})
+    
+    def remove(self, name):
+        with self._lock:
+            self._delete(name)
+    
+    def apply(self, name, update):
+        """Apply a $set / $inc update to a server's live state"""
+        with self._lock:
+            server = self._servers.get(name)
+            if server is None:
+                return
+            fields = update.get("$set", {})
+            if fields.get("status", server.get("status")) != server.get("status"):
+                self._unindex(server)
+                server.update(fields)
+                self._index(server)
+            else:
+                server.update(fields)
+            delta = dict(fields, name=name)
+            for field, value in update.get("$inc", {}).items():
+                server[field] = delta[field] = (server.get(field) or 0) + value
+            self._changed()
+            self._emit("update", delta)
+    
+    def select(self, filter):
+        """Names of the servers matching a storage filter, evaluated against live state"""
+        with self._lock:
+            return [name for name in self._names if match_document(self._servers[name], filter)]
+    
+    def get(self, name):
+        with self._lock:
+            server = self._servers.get(name)
+            return dict(server) if server else None
+    
+    def all(self):
+        with self._lock:
+            return [dict(server) for server in self._servers.values()]
+    
+    def __len__(self):
+        return len(self._servers)
+    
+    @staticmethod
+    def public(server, fields=None):
+        """API view of a server: never the password, optionally only some fields"""
+        view = {k: v for k, v in server.items() if k != "password"}
+        view["has_password"] = bool(server.get("password"))
+        if fields:
+            view = {k: v for k, v in view.items() if k in fields or k == "name"}
+        return view
+    
+    def encoded(self):
+        """JSON body and ETag for the full list, re-encoded only after a change"""
+        with self._lock:
+            if self._encoded is None or self._encoded[0] != self.version:
+                servers = [self.public(self._servers[name]) for name in self._names]
+                body = json.dumps(servers, default=str).encode()
+                etag = f'"{int(START_TIME)}-{self.version}"'
+                self._encoded = (self.version, body, etag)
+            return self._encoded[1], self._encoded[2]
+    
+    def etag(self, query_string=""):
+        return f'"{int(START_TIME)}-{self.version}-{zlib.crc32(query_string.encode()):x}"'
+    
+    def query(self, status=None, url=None, prefix="", cursor=None, limit=None, fields=None):
+        """Filtered page of servers in name order. Returns (servers, next_cursor)"""
+        limit = MAX_PAGE_SIZE if limit is None else max(min(limit, MAX_PAGE_SIZE), 1)
+        with self._lock:
+            if status is not None or url is not None:
+                candidates = None
+                for index, key in ((self._by_status, status), (self._by_url, url)):
+                    if key is not None:
+                        names = index.get(key, set())
+                        candidates = names if candidates is None else candidates & names
+                names = sorted(n for n in candidates
+                               if n.startswith(prefix) and (cursor is None or n > cursor))
+                page = names[:limit + 1]
+            else:
+                # Walk the sorted name list from the cursor / prefix start
+                start = bisect.bisect_right(self._names, cursor) if cursor else 0
+                start = max(start, bisect.bisect_left(self._names, prefix))
+                page = []
+                for name in itertools.islice(self._names, start, None):
+                    if not name.startswith(prefix) or len(page) > limit:
+                        break
+                    page.append(name)
+            
+            next_cursor = page[limit - 1] if len(page) > limit else None
+            servers = [self.public(self._servers[name], fields) for name in page[:limit]]
+        return servers, next_cursor
+
+
+def duplicate_names(limit=5):
+    """Names stored more than once, left over from before the unique index"""
+    return [doc["_id"] for doc in collection.aggregate([
+        {"$group": {"_id": "$name", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": limit},
+    ])]
+
+
+def ensure_indexes():
+    """Unique server names, plus the indexes behind the /api/servers filters.
+    Returns whether names are unique-indexed; bulk /add depends on it to reject duplicates."""
+    try:
+        collection.create_index([("status", 1), ("name", 1)])
+        collection.create_index([("url", 1), ("name", 1)])
+        collection.create_index("updated_at")
+        collection.create_index("pinged_at")
+        tombstones_collection.create_index("deleted_at")
+        try:
+            collection.create_index("name", unique=True)
+        except OperationFailure as e:
+            if e.code not in (85, 86):  # IndexOptionsConflict / IndexKeySpecsConflict
+                raise
+            # Older deployments have a plain index on name; upgrade it only if the unique one can be built
+            duplicates = duplicate_names()
+            if duplicates:
+                logger.error("❌ Duplicate server names %s; keeping the plain name index until they are removed",
+                             duplicates)
+                return False
+            collection.drop_index("name_1")
+            try:
+                collection.create_index("name", unique=True)
+            except OperationFailure:
+                collection.create_index("name")  # A duplicate slipped in meanwhile; don't leave name unindexed
+                raise
+    except STORAGE_ERRORS as e:
+        logger.error("❌ Failed to create indexes: %s", e)
+        return False
+    startup.unique_names = True
+    return True
+
+
+server_registry = ServerRegistry()
+
+
+def sse_event(event, data):
+    """Encode one Server-Sent Event; data is JSON-encoded unless already bytes"""
+    if not isinstance(data, bytes):
+        data = json.dumps(data, default=str).encode()
+    return b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+
+
+class EventHub:
+    """Fan out registry deltas to every /api/events stream from a single thread"""
+    def __init__(self, snapshot, stats=None):
+        self.snapshot = snapshot     # () -> bytes, the full list sent to new clients
+        self.stats = stats           # () -> dict, pushed every SSE_STATS_INTERVAL
+        self.is_running = False
+        self.published = 0
+        self.dropped = 0
+        self._events = deque()
+        self._joining = deque()
+        self._clients = {}           # socket -> pending bytes
+        self._limits = {}            # socket -> buffer cap while its snapshot is still draining
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+    
+    def start(self):
+        self.is_running = True
+        thread = threading.Thread(target=self._loop, daemon=True)
+        thread.start()
+        logger.info("📡 Event Hub Started")
+    
+    @property
+    def client_count(self):
+        return len(self._clients)
+    
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # A wake-up is already pending
+    
+    def publish(self, event, data):
+        """Queue an event for all clients; cheap enough to call from the ping path"""
+        if not self._clients and not self._joining:
+            return
+        self._events.append(sse_event(event, data))
+        self._wake()
+    
+    def attach(self, sock):
+        """Take over a client socket whose response headers were already sent"""
+        self._joining.append(sock)
+        self._wake()
+    
+    def _drop(self, sock):
+        self._clients.pop(sock, None)
+        self._limits.pop(sock, None)
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+    
+    def _send(self, sock):
+        pending = self._clients.get(sock)
+        if pending is None:
+            return
+        try:
+            sent = sock.send(pending)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            return self._drop(sock)
+        del pending[:sent]
+        if not pending:
+            self._limits.pop(sock, None)  # Snapshot delivered; back to the normal cap
+        mask = selectors.EVENT_READ | (selectors.EVENT_WRITE if pending else 0)
+        self._selector.modify(sock, mask)
+    
+    def _queue(self, sock, payload):
+        pending = self._clients.get(sock)
+        if pending is None:
+            return
+        if len(pending) + len(payload) > self._limits.get(sock, SSE_MAX_BUFFER):
+            self.dropped += 1
+            return self._drop(sock)
+        pending += payload
+        self._send(sock)
+    
+    def _loop(self):
+        next_keepalive = next_stats = time.monotonic()
+        while self.is_running:
+            timeout = max(0, min(next_keepalive, next_stats) - time.monotonic())
+            for key, mask in self._selector.select(timeout):
+                sock = key.fileobj
+                if sock is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                if mask & selectors.EVENT_READ:
+                    try:
+                        if not sock.recv(1024):
+                            self._drop(sock)  # Client went away
+                            continue
+                    except BlockingIOError:
+                        pass
+                    except OSError:
+                        self._drop(sock)
+                        continue
+                if mask & selectors.EVENT_WRITE:
+                    self._send(sock)
+            
+            # New clients get a snapshot before any delta published after this point
+            while self._joining:
+                sock = self._joining.popleft()
+                sock.setblocking(False)
+                self._clients[sock] = bytearray()
+                self._selector.register(sock, selectors.EVENT_READ)
+                # The snapshot grows with the fleet, so only the backlog behind it counts against the cap
+                snapshot = b"retry: 5000\n" + sse_event("snapshot", self.snapshot())
+                self._limits[sock] = len(snapshot) + SSE_MAX_BUFFER
+                self._queue(sock, snapshot)
+            
+            batch = []
+            while self._events:
+                batch.append(self._events.popleft())
+            now = time.monotonic()
+            if now >= next_keepalive:
+                batch.append(b": keepalive\n\n")
+                next_keepalive = now + SSE_KEEPALIVE
+            if self.stats and now >= next_stats:
+                if self._clients:
+                    batch.append(sse_event("stats", self.stats()))
+                next_stats = now + SSE_STATS_INTERVAL
+            
+            if batch:
+                payload = b"".join(batch)
+                self.published += len(batch)
+                for sock in list(self._clients):
+                    self._queue(sock, payload)
+
+
+def record_result(name, update, members=None):
+    """Publish a ping result to the registry and history now, and to the database on the next flush.
+    members lists every server that shared the check; the shared fields go out in one update_many,
+    each member's own latency quantiles in a per-name update."""
+    # A server removed while its ping was in flight must not get its history back
+    names = [member for member in members or [name] if server_registry.get(member) is not None]
+    if not names:
+        return
+    # pinged_at is numeric so other processes can follow results through an index
+    update = dict(update, **{"$set": dict(update.get("$set", {}), pinged_at=time.time())})
+    fields = update["$set"]
+    ok = fields.get("status") == "online"
+    response_time = fields.get("response_time") or 0
+    latencies = {}
+    for member in names:
+        latency_history.record(member, response_time, ok)
+        if ok:
+            quantiles = latency_quantiles.add(member, response_time)
+            latencies[member] = {
+                "latency_p50": quantiles["p50"],
+                "latency_p95": quantiles["p95"],
+                "latency_p99": quantiles["p99"],
+            }
+    # Window uptimes are live-only; the counters behind them are snapshotted separately
+    for member in names:
+        uptime = uptime_tracker.record(member, ok)
+        server_registry.apply(member, dict(update, **{"$set": dict(fields, **latencies.get(member, {}), **uptime)}))
+        if server_registry.get(member) is None:
+            forget_server(member)  # Removed mid-record, after its listeners already ran
+    if len(names) == 1:
+        result_writer.submit(collection, {"name": names[0]},
+                             dict(update, **{"$set": dict(fields, **latencies.get(names[0], {}))}))
+        return
+    # $inc still counts per document, so every entry's totals stay its own
+    result_writer.submit(collection, {"name": {"$in": sorted(names)}}, update, many=True)
+    for member, latency in latencies.items():
+        result_writer.submit(collection, {"name": member}, {"$set": latency})
+
+# ==================== LATENCY HISTORY ====================
+
+class LatencySketch:
+    """Mergeable quantile sketch (DDSketch) with bounded relative error and memory"""
+    def __init__(self, relative_accuracy=0.01, max_bins=512):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0  # Samples too small to index (<= 1µs)
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+    
+    def add(self, value, weight=1):
+        if value <= 0.001:
+            self.zero_count += weight
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + weight
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+        self.count += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+    
+    def _collapse(self):
+        """Fold the lowest bins together; only the smallest quantiles lose accuracy"""
+        indexes = sorted(self.bins)
+        keep = indexes[len(indexes) - self.max_bins:]
+        folded = sum(self.bins.pop(i) for i in indexes[:len(indexes) - self.max_bins])
+        self.bins[keep[0]] += folded
+    
+    def merge(self, other):
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        return self
+    
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return max(self.min, 0)
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+    
+    def quantiles(self, qs=(0.50, 0.95, 0.99)):
+        """Several quantiles in one pass over the bins, as {"p50": ..., ...} in ms"""
+        result = {f"p{round(q * 100)}": None for q in qs}
+        if not self.count:
+            return result
+        ranks = sorted((q * (self.count - 1), f"p{round(q * 100)}") for q in qs)
+        seen = self.zero_count
+        pending = iter(ranks)
+        rank, key = next(pending)
+        while rank < seen:
+            result[key] = round(max(self.min, 0), 2)
+            rank, key = next(pending, (None, None))
+            if key is None:
+                return result
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            while rank < seen:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                result[key] = round(min(max(value, self.min), self.max), 2)
+                rank, key = next(pending, (None, None))
+                if key is None:
+                    return result
+        while key is not None:
+            result[key] = round(self.max, 2)
+            rank, key = next(pending, (None, None))
+        return result
+    
+    def to_dict(self):
+        """Compact form for storage; bin keys are strings so it survives BSON/JSON"""
+        return {
+            "accuracy": self.relative_accuracy,
+            "zero": self.zero_count,
+            "count": self.count,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "bins": {str(index): count for index, count in self.bins.items()},
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(relative_accuracy=data["accuracy"])
+        sketch.bins = {int(index): count for index, count in data["bins"].items()}
+        sketch.zero_count = data["zero"]
+        sketch.count = data["count"]
+        if sketch.count:
+            sketch.min, sketch.max = data["min"], data["max"]
+        return sketch
+
+
+class RingBuffer:
+    """Fixed-capacity rows stored in parallel typed arrays; the oldest row is overwritten when full"""
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.names = [name for name, _ in columns]
+        self.columns = [array(typecode) for _, typecode in columns]
+        self.start = 0
+        self.size = 0
+    
+    def _normalize(self):
+        if self.start:
+            for col in self.columns:
+                col[:] = col[self.start:] + col[:self.start]
+            self.start = 0
+    
+    def append(self, *values):
+        length = len(self.columns[0])
+        if self.size < length:
+            index = (self.start + self.size) % length
+            self.size += 1
+        elif length < self.capacity:
+            self._normalize()  # Grow lazily; most servers never fill the ring
+            for col, value in zip(self.columns, values):
+                col.append(value)
+            self.size += 1
+            return
+        else:
+            index = self.start
+            self.start = (self.start + 1) % length
+        for col, value in zip(self.columns, values):
+            col[index] = value
+    
+    def evict_before(self, timestamp):
+        """Drop rows whose first column (a timestamp) is older than the cutoff"""
+        times = self.columns[0]
+        while self.size and times[self.start] < timestamp:
+            self.start = (self.start + 1) % len(times)
+            self.size -= 1
+    
+    def rows(self, since=0):
+        length = len(self.columns[0])
+        for i in range(self.size):
+            index = (self.start + i) % length
+            if self.columns[0][index] >= since:
+                yield tuple(col[index] for col in self.columns)
+
+
+def _nan_to_none(value):
+    return None if math.isnan(value) else round(value, 2)
+
+
+class Rollup:
+    """Fixed-width buckets of count / failures / min / avg / p95 / max"""
+    COLUMNS = (("t", "d"), ("count", "I"), ("failures", "I"),
+               ("min", "f"), ("avg", "f"), ("p95", "f"), ("max", "f"))
+    
+    def __init__(self, width, retention):
+        self.width = width
+        self.retention = retention
+        self.buckets = RingBuffer(retention // width, self.COLUMNS)
+        self._open_start = None
+        self._open = None
+    
+    def add(self, timestamp, ms, ok):
+        start = timestamp - timestamp % self.width
+        if start != self._open_start:
+            self._close()
+            self._open_start = start
+            self._open = {"count": 0, "failures": 0, "sum": 0.0, "sketch": LatencySketch(max_bins=128)}
+        bucket = self._open
+        bucket["count"] += 1
+        if ok:
+            bucket["sum"] += ms
+            bucket["sketch"].add(ms)
+        else:
+            bucket["failures"] += 1
+    
+    def _summary(self):
+        bucket = self._open
+        sketch = bucket["sketch"]
+        if sketch.count:
+            stats = (sketch.min, bucket["sum"] / sketch.count, sketch.quantile(0.95), sketch.max)
+        else:
+            stats = (math.nan,) * 4
+        return (self._open_start, bucket["count"], bucket["failures"]) + stats
+    
+    def _close(self):
+        if self._open is None:
+            return
+        self.buckets.append(*self._summary())
+        self.buckets.evict_before(self._open_start - self.retention)
+        self._open = None
+    
+    def points(self, since):
+        rows = list(self.buckets.rows(since))
+        if self._open is not None and self._open_start >= since - self.width:
+            rows.append(self._summary())
+        return [
+            {"t": t, "count": count, "failures": failures, "min": _nan_to_none(lo),
+             "avg": _nan_to_none(avg), "p95": _nan_to_none(p95), "max": _nan_to_none(hi)}
+            for t, count, failures, lo, avg, p95, hi in rows
+        ]
+
+
+class ServerHistory:
+    """Raw latency / status samples for one server plus their rollups"""
+    def __init__(self):
+        self.raw = RingBuffer(HISTORY_RAW_SAMPLES, (("t", "d"), ("ms", "f"), ("ok", "b")))
+        self.rollups = {name: Rollup(width, retention) for name, width, retention in ROLLUP_LEVELS}
+    
+    def add(self, timestamp, ms, ok):
+        self.raw.append(timestamp, ms, 1 if ok else 0)
+        for rollup in self.rollups.values():
+            rollup.add(timestamp, ms, ok)
+    
+    def points(self, resolution, since):
+        if resolution == "raw":
+            return [{"t": t, "ms": round(ms, 2), "ok": bool(ok)} for t, ms, ok in self.raw.rows(since)]
+        return self.rollups[resolution].points(since)
+
+
+class LatencyHistory:
+    """Per-server time series, held in memory"""
+    def __init__(self):
+        self._servers = {}
+        self._lock = threading.Lock()
+    
+    def record(self, name, ms, ok, timestamp=None):
+        with self._lock:
+            history = self._servers.get(name)
+            if history is None:
+                history = self._servers[name] = ServerHistory()
+            history.add(timestamp or time.time(), ms, ok)
+    
+    def on_registry_event(self, event, data):
+        if event == "removed":
+            with self._lock:
+                self._servers.pop(data["name"], None)
+    
+    @staticmethod
+    def resolution_for(span):
+        """Coarsest level that still gives a useful chart; long ranges never touch raw samples"""
+        if span <= 2 * 3600:
+            return "raw"
+        if span <= 2 * 86400:
+            return "1m"
+        if span <= 90 * 86400:
+            return "1h"
+        return "1d"
+    
+    def query(self, name, span, resolution=None):
+        resolution = resolution or self.resolution_for(span)
+        with self._lock:
+            history = self._servers.get(name)
+            if history is None:
+                return None
+            return {
+                "name": name,
+                "resolution": resolution,
+                "points": history.points(resolution, time.time() - span),
+            }
+
+
+latency_history = LatencyHistory()
+server_registry.listeners.append(latency_history.on_registry_event)
+
+
+class LatencyQuantiles:
+    """Per-server p50/p95/p99 from fixed-size sketches, merged across nodes for the fleet"""
+    def __init__(self, interval=SKETCH_SNAPSHOT_INTERVAL, timers=timer_service):
+        self.interval = interval
+        self.timers = timers
+        self.fleet = LatencySketch()
+        self._servers = {}
+        self._remote = {}  # node -> LatencySketch from its last snapshot
+        self._lock = threading.Lock()
+    
+    def start(self):
+        self.timers.call_later(self.interval, self._snapshot)
+    
+    def add(self, name, ms):
+        """Record a successful ping; returns the server's updated quantiles"""
+        with self._lock:
+            sketch = self._servers.get(name)
+            if sketch is None:
+                sketch = self._servers[name] = LatencySketch()
+            sketch.add(ms)
+            self.fleet.add(ms)
+            return sketch.quantiles()
+    
+    def get(self, name):
+        with self._lock:
+            sketch = self._servers.get(name)
+            return LatencySketch().merge(sketch) if sketch else None
+    
+    def on_registry_event(self, event, data):
+        if event == "removed":
+            with self._lock:
+                self._servers.pop(data["name"], None)
+    
+    def fleet_quantiles(self):
+        """Quantiles over every server on every node that shared a recent snapshot"""
+        with self._lock:
+            merged = LatencySketch().merge(self.fleet)
+            for sketch in self._remote.values():
+                merged.merge(sketch)
+        return dict(merged.quantiles(), samples=merged.count, nodes=1 + len(self._remote))
+    
+    def _snapshot(self):
+        try:
+            with self._lock:
+                snapshot = self.fleet.to_dict()
+            result_writer.submit(
+                stats_collection,
+                {"type": "latency_sketch", "node": NODE_ID},
+                {"$set": {"sketch": snapshot, "updated_at": datetime.now()}},
+                upsert=True
+            )
+            
+            fresh = datetime.now() - timedelta(seconds=self.interval * 5)
+            remote = {
+                doc["node"]: LatencySketch.from_dict(doc["sketch"])
+                for doc in stats_collection.find(
+                    {"type": "latency_sketch", "node": {"$ne": NODE_ID}, "updated_at": {"$gte": fresh}},
+                    {"_id": 0, "node": 1, "sketch": 1}
+                )
+            }
+            with self._lock:
+                self._remote = remote
+        except STORAGE_ERRORS as e:
+            logger.error("❌ Latency sketch snapshot failed: %s", e)
+        finally:
+            self.timers.call_later(self.interval, self._snapshot)
+
+
+latency_quantiles = LatencyQuantiles()
+server_registry.listeners.append(latency_quantiles.on_registry_event)
+
+# ==================== UPTIME WINDOWS ====================
+
+class UptimeWindow:
+    """Sliding-window success ratio from a ring of fixed-width bucket counters.
+    Running sums are kept for the buckets still in the window, so reads don't walk the ring."""
+    def __init__(self, span, width):
+        self.width = width
+        self.size = span // width
+        self.stamps = array("q", [-1]) * self.size  # Bucket number held in each slot
+        self.ok = array("I", [0]) * self.size
+        self.total = array("I", [0]) * self.size
+        self.sum_ok = self.sum_total = 0
+        self.expired = None  # Newest bucket already subtracted from the sums
+    
+    def _advance(self, bucket):
+        """Subtract buckets that slid out of the window; each bucket is expired once"""
+        oldest = bucket - self.size
+        if self.expired is None or oldest - self.expired >= self.size:
+            # First use, or a whole span without records: nothing left in the window
+            self.sum_ok = self.sum_total = 0
+            self.expired = oldest
+            return
+        for expired in range(self.expired + 1, oldest + 1):
+            slot = expired % self.size
+            if self.stamps[slot] == expired:
+                self.sum_ok -= self.ok[slot]
+                self.sum_total -= self.total[slot]
+        self.expired = max(self.expired, oldest)
+    
+    def record(self, timestamp, ok):
+        bucket = int(timestamp // self.width)
+        self._advance(bucket)
+        if bucket <= self.expired:
+            return  # Already outside the window
+        slot = bucket % self.size
+        if self.stamps[slot] != bucket:
+            # The slot's previous bucket is a whole span older, so _advance already subtracted it
+            self.stamps[slot] = bucket
+            self.ok[slot] = self.total[slot] = 0
+        self.total[slot] += 1
+        self.sum_total += 1
+        if ok:
+            self.ok[slot] += 1
+            self.sum_ok += 1
+    
+    def uptime(self, now):
+        self._advance(int(now // self.width))
+        return round(self.sum_ok / self.sum_total * 100, 2) if self.sum_total else None
+    
+    def to_list(self, now):
+        oldest = int(now // self.width) - self.size
+        return [[self.stamps[i], self.ok[i], self.total[i]] for i in range(self.size) if self.stamps[i] > oldest]
+    
+    def load(self, rows):
+        for bucket, ok, total in rows:
+            slot = bucket % self.size
+            self.stamps[slot], self.ok[slot], self.total[slot] = bucket, ok, total
+        # Rebuild the sums once from whatever is now in the ring
+        self.expired = max(self.stamps) - self.size
+        live = [i for i in range(self.size) if self.stamps[i] > self.expired]
+        self.sum_ok = sum(self.ok[i] for i in live)
+        self.sum_total = sum(self.total[i] for i in live)
+
+
+class UptimeTracker:
+    """1h/24h/7d/30d uptime per server, persisted by periodic snapshot instead of per ping"""
+    def __init__(self, interval=UPTIME_SNAPSHOT_INTERVAL, timers=timer_service):
+        self.interval = interval
+        self.timers = timers
+        self._servers = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+    
+    def start(self):
+        self.timers.call_later(self.interval, self._snapshot)
+    
+    def _windows(self, name):
+        windows = self._servers.get(name)
+        if windows is None:
+            windows = self._servers[name] = {
+                label: UptimeWindow(span, width) for label, span, width in UPTIME_WINDOWS
+            }
+        return windows
+    
+    def record(self, name, ok, timestamp=None):
+        """Amortised O(1) update and read; returns the server's current uptime per window"""
+        now = timestamp or time.time()
+        with self._lock:
+            windows = self._windows(name)
+            for window in windows.values():
+                window.record(now, ok)
+            self._dirty.add(name)
+            return {f"uptime_{label}": window.uptime(now) for label, window in windows.items()}
+    
+    def restore(self, docs):
+        """Seed counters from the snapshot stored on each server document"""
+        with self._lock:
+            for doc in docs:
+                snapshot = doc.pop("uptime_buckets", None)
+                if snapshot and doc["name"] not in self._servers:
+                    for label, window in self._windows(doc["name"]).items():
+                        window.load(snapshot.get(label, []))
+    
+    def on_registry_event(self, event, data):
+        if event == "removed":
+            with self._lock:
+                self._servers.pop(data["name"], None)
+                self._dirty.discard(data["name"])
+    
+    def _snapshot(self):
+        try:
+            now = time.time()
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                snapshots = {
+                    name: {label: window.to_list(now) for label, window in self._servers[name].items()}
+                    for name in dirty if name in self._servers
+                }
+            for name, snapshot in snapshots.items():
+                result_writer.submit(collection, {"name": name}, {"$set": {"uptime_buckets": snapshot}})
+        finally:
+            self.timers.call_later(self.interval, self._snapshot)
+
+
+uptime_tracker = UptimeTracker()
+server_registry.listeners.append(uptime_tracker.on_registry_event)
+
+# ==================== PING & MONITORING ====================
+
+def ping_server(name, url, email=None, password=None, timeout=PING_TIMEOUT, timing_mode=PING_TIMING_MODE,
+                check_mode=PING_CHECK_MODE, expect=None, members=None):
+    """Ping a server and log the result. Returns True if the server responded.
+    members: every server coalesced onto this check; the result is recorded for all of them."""
+    label = f"{name} (+{len(members) - 1} coalesced)" if members and len(members) > 1 else name
+    headers = {
+        "User-Agent": random.choice(USER_AGENTS),
+        "Cache-Control": "no-cache",
+        "Pragma": "no-cache",
+    }
+    
+    try:
+        start_time = time.time()
+        status_code, timings, content_hash = check_url(
+            url, headers, timeout, check_mode or PING_CHECK_MODE, expect, timing_mode
+        )
+        response_time = timings["total"] if timings else round((time.time() - start_time) * 1000, 2)
+        
+        # Update status in database
+        update = {
+            "last_ping": datetime.now(),
+            "status": "online",
+            "status_code": status_code,
+            "response_time": response_time,
+            "error": None,
+            "consecutive_failures": 0
+        }
+        if timings:
+            update["timings"] = timings
+        if content_hash:
+            update["content_hash"] = content_hash
+        record_result(
+            name,
+            {
+                "$set": update,
+                "$inc": {"total_pings": 1, "successful_pings": 1}
+            },
+            members
+        )
+        logger.info("✅ %s (%s) - Status: %s - Time: %sms", label, url, status_code, response_time,
+                    extra={"server": name, "url": url, "status_code": status_code, "response_ms": response_time})
+        return True
+        
+    except (requests.exceptions.RequestException, OSError, http.client.HTTPException) as e:
+        error_msg = str(e)
+        
+        record_result(
+            name,
+            {
+                "$set": {
+                    "last_ping": datetime.now(),
+                    "status": "offline",
+                    "error": error_msg,
+                    "response_time": 0
+                },
+                "$inc": {
+                    "total_pings": 1, 
+                    "failed_pings": 1,
+                    "consecutive_failures": 1
+                }
+            },
+            members
+        )
+        logger.error("❌ %s (%s) - Failed: %s", label, url, error_msg, extra={"server": name, "url": url})
+        return False
+
+
+class StartupState:
+    """Startup milestones behind /ready, timed from process creation"""
+    def __init__(self):
+        self.process_start = psutil.Process().create_time()
+        self.storage_ready = False
+        self.registry_loaded = False
+        self.first_ping_ms = None
+        self.unique_names = False  # Set once ensure_indexes() has a unique index on name
+        self.error = None
+    
+    def elapsed_ms(self):
+        return round((time.time() - self.process_start) * 1000, 1)
+    
+    def mark_storage_ready(self):
+        self.storage_ready = True
+        self.error = None
+        logger.info("✅ Storage reachable after %sms", self.elapsed_ms())
+    
+    def mark_registry_loaded(self, count):
+        if not self.registry_loaded:
+            self.registry_loaded = True
+            logger.info("📋 Loaded %d server(s) after %sms", count, self.elapsed_ms())
+    
+    def mark_first_ping(self):
+        if self.first_ping_ms is None:
+            self.first_ping_ms = self.elapsed_ms()
+            logger.info("⚡ First ping started %sms after process start", self.first_ping_ms)
+    
+    def status(self):
+        return {
+            "ready": self.storage_ready,
+            "storage": STORAGE_BACKEND,
+            "registry_loaded": self.registry_loaded,
+            "servers": len(server_registry),
+            "first_ping_ms": self.first_ping_ms,
+            "unique_names": self.unique_names,
+            "error": self.error,
+        }
+
+
+startup = StartupState()
+
+
+class CircuitBreaker:
+    """Per-server closed / open / half-open state driven by consecutive failures"""
+    def __init__(self, threshold=BREAKER_THRESHOLD, base_delay=BREAKER_BASE_DELAY, max_delay=BREAKER_MAX_DELAY):
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._state = {}  # name -> [consecutive failures, monotonic time of the next probe, probe in flight]
+        self._lock = threading.Lock()
+    
+    def _entry(self, server):
+        entry = self._state.get(server['name'])
+        if entry is None:
+            # Seed from the stored counter so an open circuit survives a restart; probe right away
+            failures = server.get('consecutive_failures') or 0
+            entry = self._state[server['name']] = [failures, time.monotonic(), False]
+        return entry
+    
+    def allow(self, server):
+        """True if a ping may go out: the circuit is closed, or this is the single half-open probe"""
+        with self._lock:
+            entry = self._entry(server)
+            if entry[0] < self.threshold:
+                return True
+            if entry[2] or time.monotonic() < entry[1]:
+                return False
+            entry[2] = True
+            return True
+    
+    def record(self, server, ok):
+        """Update the circuit after a ping; returns the new state if it changed"""
+        name = server['name']
+        with self._lock:
+            entry = self._entry(server)
+            was_open = entry[0] >= self.threshold
+            if ok:
+                self._state.pop(name, None)
+                return "closed" if was_open else None
+            entry[0] += 1
+            entry[2] = False
+            if entry[0] < self.threshold:
+                return None
+            # Exponential backoff with equal jitter, so a fleet that failed together doesn't probe together
+            delay = min(self.max_delay, self.base_delay * 2 ** (entry[0] - self.threshold))
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            entry[1] = time.monotonic() + delay
+            if not was_open:
+                logger.warning("🔌 Circuit open for %s after %d failures, probing in %.0fs", name, entry[0], delay,
+                               extra={"server": name})
+                return "open"
+            return None
+    
+    def retry_in(self, name):
+        """Seconds until the next half-open probe, or 0 if the circuit is closed"""
+        with self._lock:
+            entry = self._state.get(name)
+            if entry is None or entry[0] < self.threshold:
+                return 0
+            return max(entry[1] - time.monotonic(), 0)
+    
+    def open_count(self):
+        with self._lock:
+            return sum(1 for entry in self._state.values() if entry[0] >= self.threshold)
+    
+    def on_registry_event(self, event, data):
+        if event == "removed":
+            with self._lock:
+                self._state.pop(data["name"], None)
+
+
+circuit_breaker = CircuitBreaker()
+server_registry.listeners.append(circuit_breaker.on_registry_event)
+metrics.add(Gauge("monitor_circuits_open", "Servers whose circuit breaker is open",
+                  function=circuit_breaker.open_count))
+FAST_FAILS = metrics.add(Counter("monitor_circuit_fast_fail_total", "Pings skipped because the circuit was open"))
+
+
+def forget_server(name):
+    """Drop the per-server state a late ping re-created for a server that is no longer registered"""
+    removed = {"name": name}
+    for component in (latency_history, latency_quantiles, uptime_tracker, circuit_breaker):
+        component.on_registry_event("removed", removed)
+
+
+def ping_timeout(name):
+    """A multiple of the server's p99 once enough samples exist, otherwise the flat PING_TIMEOUT"""
+    sketch = latency_quantiles.get(name)
+    if sketch is None or sketch.count < TIMEOUT_MIN_SAMPLES:
+        return PING_TIMEOUT
+    p99 = sketch.quantile(0.99) / 1000
+    return round(min(max(p99 * TIMEOUT_P99_FACTOR, TIMEOUT_MIN), PING_TIMEOUT), 2)
+
+
+class PingEngine:
+    """Bounded-concurrency ping executor with a per-host cap"""
+    def __init__(self, max_in_flight=PING_CONCURRENCY, per_host_limit=PING_PER_HOST_LIMIT):
+        self.max_in_flight = max_in_flight
+        self.per_host_limit = per_host_limit
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="ping")
+        self.in_flight = 0
+        self.last_round_duration = None
+        self._lock = threading.Lock()
+        self._host_active = defaultdict(int)
+        self._host_pending = defaultdict(deque)
+    
+    @staticmethod
+    def host_key(url):
+        return urlparse(url).netloc.lower()
+    
+    def submit(self, server, callback=None, due=None):
+        """Queue a ping; it waits for a free host slot instead of holding a worker"""
+        host = self.host_key(server['url'])
+        with self._lock:
+            if self._host_active[host] >= self.per_host_limit:
+                self._host_pending[host].append((server, callback, due))
+                return
+            self._host_active[host] += 1
+        self.executor.submit(self._run, host, server, callback, due)
+    
+    def _run(self, host, server, callback, due=None):
+        with self._lock:
+            self.in_flight += 1
+        if due is not None:
+            SCHEDULER_LAG.observe(max(time.monotonic() - due, 0))
+        if startup.first_ping_ms is None:
+            startup.mark_first_ping()
+        ok = False
+        result = "error"
+        start = time.perf_counter()
+        try:
+            if not circuit_breaker.allow(server):
+                # Open circuit: fail fast without touching the network or a host slot's time
+                result = "fast_fail"
+                FAST_FAILS.inc()
+            else:
+                ok = ping_server(
+                    server['name'],
+                    server['url'],
+                    server.get('email'),
+                    server.get('password'),
+                    timeout=ping_timeout(server['name']),
+                    check_mode=server.get('check_mode'),
+                    expect=server.get('expect'),
+                    members=server.get('members')
+                )
+                result = "ok" if ok else "error"
+                for name in server.get('members') or [server['name']]:
+                    member = server if name == server['name'] else server_registry.get(name) or {"name": name}
+                    changed = circuit_breaker.record(member, ok)
+                    if changed:
+                        server_registry.apply(name, {"$set": {"circuit": changed}})
+        except Exception as e:
+            logger.error("❌ Ping worker error for %s: %s", server.get('name'), e)
+            if result != "fast_fail":
+                circuit_breaker.record(server, False)  # Don't leave a half-open probe marked in flight
+        finally:
+            # Removed while queued or in flight: drop the breaker entry allow()/record() re-created
+            for name in server.get('members') or [server['name']]:
+                if server_registry.get(name) is None:
+                    forget_server(name)
+            PING_DURATION.labels(result=result).observe(time.perf_counter() - start)
+            with self._lock:
+                self.in_flight -= 1
+                pending = self._host_pending.get(host)
+                if pending:
+                    next_job = pending.popleft()
+                else:
+                    next_job = None
+                    self._host_active[host] -= 1
+                    if not self._host_active[host]:
+                        del self._host_active[host]
+                        self._host_pending.pop(host, None)
+            if next_job:
+                self.executor.submit(self._run, host, *next_job)
+        
+        if callback:
+            callback(server, ok)
+    
+    def run_round(self, servers):
+        """Ping every server concurrently and block until all have finished"""
+        start = time.time()
+        done = threading.Semaphore(0)
+        results = []
+        
+        def on_done(server, ok):
+            results.append(ok)
+            done.release()
+        
+        for server in servers:
+            self.submit(server, on_done)
+        for _ in servers:
+            done.acquire()
+        
+        self.last_round_duration = round(time.time() - start, 3)
+        return sum(results), len(results) - sum(results), self.last_round_duration
+
+
+ping_engine = PingEngine()
+metrics.add(Gauge("monitor_pings_in_flight", "Pings currently running", function=lambda: ping_engine.in_flight))
+
+
+def server_interval(server):
+    """Ping interval of a server document in seconds"""
+    try:
+        interval = int(server.get('interval') or DEFAULT_PING_INTERVAL)
+    except (TypeError, ValueError):
+        interval = DEFAULT_PING_INTERVAL
+    return max(interval, MIN_PING_INTERVAL)
+
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+COALESCED = metrics.add(Counter("monitor_pings_coalesced_total", "Checks saved by sharing one with a same-URL server"))
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_url(url):
+    """Same endpoint, same key: lower-case scheme and host, no default port, empty path as /, no fragment"""
+    try:
+        parsed = urlparse(url.strip())
+        scheme = parsed.scheme.lower()
+        host = (parsed.hostname or "").lower()
+        port = parsed.port
+    except ValueError:
+        return url
+    if ":" in host:
+        host = f"[{host}]"
+    netloc = host if port in (None, DEFAULT_PORTS.get(scheme)) else f"{host}:{port}"
+    if parsed.username is not None:
+        credentials = parsed.username + (f":{parsed.password}" if parsed.password is not None else "")
+        netloc = f"{credentials}@{netloc}"
+    return urlunparse((scheme, netloc, parsed.path or "/", parsed.params, parsed.query, ""))
+
+
+def ping_key(server):
+    """Servers with the same key get identical checks, so one check can serve them all"""
+    return (normalize_url(server['url']), server.get('check_mode') or PING_CHECK_MODE, server.get('expect') or "")
+
+
+class PingScheduler:
+    """Ping each server when it is due, using a heap keyed on next-due time"""
+    def __init__(self, engine, coalesce=PING_COALESCE, coalesce_window=COALESCE_WINDOW):
+        self.engine = engine
+        self.coalesce = coalesce
+        self.coalesce_window = coalesce_window
+        self.is_running = False
+        self._heap = []        # (due, seq, name); stale entries are skipped lazily
+        self._due = {}         # name -> due time of its live heap entry
+        self._servers = {}     # name -> server document
+        self._groups = defaultdict(set)  # ping_key -> names sharing that check
+        self._keys = {}        # name -> its ping_key
+        self._in_flight = set()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+    
+    def start(self):
+        self.is_running = True
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        logger.info("🗓️ Ping Scheduler Started")
+    
+    def _schedule(self, name, due):
+        self._due[name] = due
+        heapq.heappush(self._heap, (due, next(self._seq), name))
+    
+    def _initial_due(self, server, now):
+        """Resume from the last ping so a restart doesn't ping everything at once"""
+        last_ping = server.get('last_ping')
+        if not isinstance(last_ping, datetime):
+            return now
+        elapsed = (datetime.now() - last_ping).total_seconds()
+        return now + max(0, server_interval(server) - elapsed)
+    
+    def add(self, server):
+        with self._cond:
+            name = server['name']
+            known = self._servers.get(name)
+            self._servers[name] = server
+            self._regroup(name, ping_key(server))
+            if name in self._in_flight:
+                return
+            now = time.monotonic()
+            if known is None:
+                self._schedule(name, self._initial_due(server, now))
+            elif server_interval(known) != server_interval(server):
+                self._schedule(name, min(self._due.get(name, now), now + server_interval(server)))
+            else:
+                return
+            self._cond.notify()
+    
+    def _regroup(self, name, key):
+        old = self._keys.get(name)
+        if old == key:
+            return
+        if old is not None:
+            self._groups[old].discard(name)
+            if not self._groups[old]:
+                del self._groups[old]
+        if key is None:
+            self._keys.pop(name, None)
+        else:
+            self._keys[name] = key
+            self._groups[key].add(name)
+    
+    def remove(self, name):
+        with self._cond:
+            self._servers.pop(name, None)
+            self._due.pop(name, None)
+            self._regroup(name, None)
+    
+    def sync(self, servers):
+        """Reconcile the schedule with a fresh list of server documents"""
+        names = set()
+        for server in servers:
+            names.add(server['name'])
+            self.add(server)
+        with self._cond:
+            for name in set(self._servers) - names:
+                self.remove(name)
+    
+    def __len__(self):
+        return len(self._servers)
+    
+    def _pop_due(self):
+        """Block until at least one server is due, then return all due servers"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                due_servers = []
+                while self._heap and self._heap[0][0] <= now:
+                    due, _, name = heapq.heappop(self._heap)
+                    if self._due.get(name) != due:
+                        continue
+                    del self._due[name]
+                    self._in_flight.add(name)
+                    due_servers.append((self._servers[name], due))
+                if due_servers:
+                    if self.coalesce:
+                        self._pull_forward(due_servers, now)
+                    return due_servers
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._cond.wait(timeout)
+    
+    def _run(self):
+        while self.is_running:
+            due_servers = self._pop_due()
+            self._dispatch(due_servers)
+    
+    def _pull_forward(self, due_servers, now):
+        """Add group members due within the coalescing window, so the whole group shares this check"""
+        for key in {self._keys.get(server['name']) for server, _ in due_servers}:
+            for name in self._groups.get(key, ()):
+                due = self._due.get(name)
+                if due is not None and due <= now + self.coalesce_window and name not in self._in_flight:
+                    del self._due[name]
+                    self._in_flight.add(name)
+                    due_servers.append((self._servers[name], due))
+    
+    def _dispatch(self, servers):
+        start = time.time()
+        groups = defaultdict(list)
+        for server, due in servers:
+            groups[ping_key(server) if self.coalesce else server['name']].append((server, due))
+        remaining = [len(groups)]
+        lock = threading.Lock()
+        
+        def on_done(members, server, ok):
+            for member in members:
+                self._reschedule(member)
+            with lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished:
+                self.engine.last_round_duration = round(time.time() - start, 3)
+                logger.info("⏱️ Pinged %d due server(s) with %d check(s) in %ss",
+                            len(servers), len(groups), self.engine.last_round_duration)
+        
+        for group in groups.values():
+            members = [server for server, _ in group]
+            leader = members[0]
+            if len(members) > 1:
+                # One check for the group; the engine fans the result out to every member
+                leader = dict(leader, members=[server['name'] for server in members])
+                COALESCED.inc(len(members) - 1)
+            self.engine.submit(leader, functools.partial(on_done, members), min(due for _, due in group))
+    
+    def _reschedule(self, server):
+        with self._cond:
+            name = server['name']
+            self._in_flight.discard(name)
+            current = self._servers.get(name)
+            if current is None:
+                return
+            # An open circuit pushes the next ping out to its half-open probe
+            delay = max(server_interval(current), circuit_breaker.retry_in(name))
+            self._schedule(name, time.monotonic() + delay)
+            self._cond.notify()
+
+
+ping_scheduler = PingScheduler(ping_engine)
+
+
+# ==================== SHARDING ====================
+
+def shard_of(name):
+    """Stable across processes, unlike hash()"""
+    return zlib.crc32(name.encode()) % SHARD_COUNT
+
+
+class ShardLeases:
+    """Splits the fleet between workers; each renews leases on a fair share of the shards"""
+    def __init__(self, node_id=NODE_ID, shards=SHARD_COUNT, ttl=LEASE_TTL, interval=LEASE_RENEW_INTERVAL,
+                 timers=timer_service):
+        self.node_id = node_id
+        self.shards = shards
+        self.ttl = ttl
+        self.interval = interval
+        self.timers = timers
+        self.enabled = False
+        self.owned = frozenset()  # Replaced wholesale, so owns() needs no lock
+        self.expires_at = 0       # When the held leases lapse unless renewed again
+        self.workers = 0
+        self.listeners = []       # Called with the new owned set after every change
+        self._seeded = False
+        self._announced = False
+    
+    def start(self):
+        self.enabled = True
+        self.timers.start()
+        self.timers.call_later(0, self._tick)
+        logger.info("🧩 Shard leases started (%d shards, node %s)", self.shards, self.node_id)
+    
+    def owns(self, name):
+        return not self.enabled or shard_of(name) in self.owned
+    
+    def _tick(self):
+        delay = self.interval
+        try:
+            if not self._announced:
+                # Heartbeat once before claiming, so workers started together split the shards
+                # instead of the first one grabbing everything and handing most of it back
+                self._heartbeat(time.time())
+                self._announced = True
+                delay = min(self.interval, 2)
+            else:
+                self.rebalance()
+        except STORAGE_ERRORS as e:
+            logger.error("❌ Lease renewal failed: %s", e)
+            # Stop pinging before another worker may claim the shards we could not renew
+            if self.owned and time.time() >= self.expires_at - self.interval:
+                logger.warning("🧩 Leases expiring unrenewed, dropping %d shard(s)", len(self.owned))
+                self._set_owned(frozenset())
+        finally:
+            self.timers.call_later(delay, self._tick)
+    
+    def _seed(self):
+        leases_collection.create_index("shard", unique=True)
+        leases_collection.bulk_update([
+            ({"shard": shard}, {"$setOnInsert": {"owner": None, "expires_at": 0}}, True, False)
+            for shard in range(self.shards)
+        ])
+        self._seeded = True
+    
+    def _heartbeat(self, now):
+        workers_collection.update_one({"node": self.node_id}, {"$set": {"heartbeat": now}}, upsert=True)
+    
+    def rebalance(self):
+        """Heartbeat, renew held leases, then release or claim shards toward a fair share"""
+        if not self._seeded:
+            self._seed()
+        now = time.time()
+        self._heartbeat(now)
+        # list(): on Mongo find() is a cursor with no len()
+        workers = list(workers_collection.find({"heartbeat": {"$gte": now - self.ttl}}, {"_id": 0, "node": 1}))
+        target = math.ceil(self.shards / max(len(workers), 1))
+        
+        leases_collection.update_many({"owner": self.node_id}, {"$set": {"expires_at": now + self.ttl}})
+        self.expires_at = now + self.ttl
+        held = sorted(doc["shard"] for doc in leases_collection.find({"owner": self.node_id}, {"_id": 0, "shard": 1}))
+        
+        if len(held) > target:
+            # Hand the surplus back right away so a joining worker can pick it up
+            leases_collection.update_many(
+                {"owner": self.node_id, "shard": {"$in": held[target:]}},
+                {"$set": {"owner": None, "expires_at": 0}}
+            )
+            held = held[:target]
+        while len(held) < target:
+            lease = leases_collection.find_one_and_update(
+                {"$or": [{"owner": None}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.node_id, "expires_at": now + self.ttl}},
+                return_document=True
+            )
+            if lease is None:
+                break
+            held.append(lease["shard"])
+        
+        self.workers = len(workers)
+        owned = frozenset(held)
+        if owned != self.owned:
+            logger.info("🧩 Holding %d/%d shards across %d worker(s)", len(owned), self.shards, self.workers)
+            self._set_owned(owned)
+    
+    def _set_owned(self, owned):
+        self.owned = owned
+        for listener in self.listeners:
+            listener(owned)
+    
+    def release(self):
+        """Give up every lease now instead of waiting for them to expire"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        try:
+            leases_collection.update_many({"owner": self.node_id}, {"$set": {"owner": None, "expires_at": 0}})
+            workers_collection.delete_one({"node": self.node_id})
+        except STORAGE_ERRORS as e:
+            logger.error("❌ Lease release failed: %s", e)
+    
+    def status(self):
+        return {"enabled": self.enabled, "owned": len(self.owned), "total": self.shards, "workers": self.workers}
+
+
+shard_leases = ShardLeases()
+metrics.add(Gauge("monitor_shards_owned", "Shard leases held by this worker", function=lambda: len(shard_leases.owned)))
+
+
+def pings_here(server):
+    """True if this worker should be pinging the server"""
+    return shard_leases.owns(server['name']) and not server.get('paused')
+
+
+def pinged_elsewhere(name):
+    """True if another worker holds the server's shard, so its stored results are the live ones"""
+    return not shard_leases.owns(name)
+
+
+def schedule_owned():
+    """Point the scheduler at the unpaused registry servers whose shard this worker holds"""
+    ping_scheduler.sync([server for server in server_registry.all() if pings_here(server)])
+
+
+def load_registry():
+    """Load every server document into the registry and the schedule"""
+    started = time.time()
+    docs = list(collection.find({}, REGISTRY_PROJECTION))
+    registry_watcher.loaded(docs, started)
+    uptime_tracker.restore(docs)
+    server_registry.sync(docs, remote=pinged_elsewhere)
+    schedule_owned()
+
+
+class RegistryWatcher:
+    """Keeps the registry current after the initial load, at a cost proportional to the changes.
+    Uses a Mongo change stream when the deployment has one, otherwise polls the updated_at
+    watermark that every config write bumps, plus tombstones for deletes."""
+    # Ping results don't bump updated_at, so they never reach the stream
+    PIPELINE = [{"$match": {"$or": [
+        {"operationType": {"$in": ["insert", "replace", "delete"]}},
+        {"updateDescription.updatedFields.updated_at": {"$exists": True}},
+    ]}}]
+    
+    def __init__(self, interval=REGISTRY_REFRESH_INTERVAL):
+        self.interval = interval
+        self.streaming = STORAGE_BACKEND == "mongo" and REGISTRY_CHANGE_STREAMS
+        self.watermark = 0          # Newest updated_at seen
+        self.tombstone_mark = 0     # Newest deleted_at seen
+        self.polled_at = 0          # Last full load or successful poll
+        self.results_mark = 0       # Start of the last read of other workers' ping results
+        self.changes = 0
+        self._ids = {}              # Mongo _id -> name, for delete events
+        self._pruned = 0
+        self._reconciled = 0
+    
+    def loaded(self, docs, started):
+        """Note a full load so the next poll only asks for what changed since"""
+        self.watermark = max([started] + [doc.get("updated_at") or 0 for doc in docs])
+        self.tombstone_mark = max(self.tombstone_mark, started)
+        self.polled_at = started
+        self.results_mark = started
+        self._reconciled = started
+        self._ids = {doc["_id"]: doc["name"] for doc in docs if "_id" in doc}
+    
+    def apply(self, docs, deleted=()):
+        """Merge changed documents and drop deleted names, then fix up the schedule"""
+        docs = [doc for doc in docs if doc.get("name")]
+        uptime_tracker.restore(docs)
+        server_registry.merge(docs, remote=pinged_elsewhere)
+        for doc in docs:
+            server = server_registry.get(doc["name"])
+            if server and pings_here(server):
+                ping_scheduler.add(server)
+            else:
+                ping_scheduler.remove(doc["name"])
+        for name, deleted_at in deleted:
+            server = server_registry.get(name)
+            # A server re-added under the same name after its delete stays
+            if server is not None and (server.get("updated_at") or 0) <= deleted_at:
+                server_registry.remove(name)
+                ping_scheduler.remove(name)
+        self.changes += len(docs) + len(deleted)
+        REGISTRY_CHANGES.inc(len(docs) + len(deleted))
     
-    def start(self):
-        self.is_running = True
-        thread = threading.Thread(target=self._monitor, daemon=True)
-        thread.start()
-        logger.info("😴 Sleep Prevention Started")
+    def poll(self):
+        """Fetch documents and tombstones newer than the watermarks"""
+        now = time.time()
+        if now - self.polled_at > TOMBSTONE_RETENTION:
+            load_registry()  # Tombstones we'd need may already be pruned
+            return
+        docs = list(collection.find({"updated_at": {"$gt": self.watermark - WATERMARK_SLACK}},
+                                    POLL_PROJECTION))
+        tombstones = list(tombstones_collection.find({"deleted_at": {"$gt": self.tombstone_mark - WATERMARK_SLACK}},
+                                                     {"_id": 0}))
+        self.apply(docs, [(t["name"], t["deleted_at"]) for t in tombstones])
+        self.watermark = max([self.watermark] + [doc.get("updated_at") or 0 for doc in docs])
+        self.tombstone_mark = max([self.tombstone_mark] + [t["deleted_at"] for t in tombstones])
+        self.polled_at = now
+        if now - self._reconciled > REGISTRY_RECONCILE_INTERVAL:
+            self.reconcile()
+        if now - self._pruned > 3600:
+            self._pruned = now
+            tombstones_collection.delete_many({"deleted_at": {"$lt": now - TOMBSTONE_RETENTION}})
     
-    def _monitor(self):
-        while self.is_running:
-            idle_time = time.time() - self.last_activity
-            
-            if idle_time >= self.sleep_threshold:
-                logger.warning(f"⚠️ Idle for {int(idle_time)}s - Generating Activity!")
-                self._generate_activity()
-            
-            time.sleep(0.0001)  # Check every minute
+    def reconcile(self):
+        """Drop servers deleted without a tombstone, e.g. by hand in the database; reads names only"""
+        # Anything stamped after the read started (less slack for late commits) was added meanwhile and stays
+        started = time.time()
+        stored = {doc["name"] for doc in collection.find({}, {"_id": 0, "name": 1})}
+        gone = [name for name in server_registry.select({}) if name not in stored]
+        self.apply([], [(name, started - WATERMARK_SLACK) for name in gone])
+        self._reconciled = started
     
-    def _generate_activity(self):
+    def follow_results(self):
+        """Merge the ping results other workers stored since the last read; they don't bump
+        updated_at, so neither the poll nor the change stream sees them"""
         try:
-            requests.get("http://localhost:8000/heartbeat", timeout=2)
-            self.update_activity()
-            logger.info("✅ Activity Generated - Sleep Prevented")
-        except:
-            pass
+            if len(shard_leases.owned) < shard_leases.shards:
+                started = time.time()
+                # Results reach storage up to a flush interval after they were stamped
+                docs = collection.find({"pinged_at": {"$gt": self.results_mark - WATERMARK_SLACK - WRITE_FLUSH_INTERVAL}},
+                                       RESULTS_PROJECTION)
+                server_registry.merge_results([doc for doc in docs if pinged_elsewhere(doc["name"])])
+                self.results_mark = started
+        except STORAGE_ERRORS as e:
+            logger.error("❌ Reading other workers' results failed: %s", e)
+        finally:
+            timer_service.call_later(self.interval, self.follow_results)
     
-    def update_activity(self):
-        self.last_activity = time.time()
+    def stream(self):
+        """Apply change events as they arrive; returns only if the stream fails"""
+        with collection.watch(self.PIPELINE, full_document="updateLookup") as changes:
+            logger.info("👀 Watching the servers collection for changes")
+            for change in changes:
+                key = change["documentKey"]["_id"]
+                if change["operationType"] == "delete":
+                    name = self._ids.pop(key, None)
+                    if name:
+                        self.apply([], [(name, time.time())])
+                elif change.get("fullDocument"):
+                    doc = change["fullDocument"]
+                    self._ids[key] = doc.get("name")
+                    self.apply([doc])
+    
+    def run(self):
+        """Follow changes forever, falling back to polling if the deployment has no change streams"""
+        if shard_leases.enabled:
+            timer_service.start()
+            timer_service.call_later(self.interval, self.follow_results)
+        while True:
+            if self.streaming:
+                try:
+                    self.stream()
+                except OperationFailure as e:
+                    if e.code in (40573, 40324, 136):  # Not a replica set / unknown stage / no oplog
+                        logger.warning("⚠️ Change streams unavailable, polling every %ss: %s", self.interval, e)
+                        self.streaming = False
+                        continue
+                    logger.error("❌ Change stream failed: %s", e)
+                except PyMongoError as e:
+                    logger.error("❌ Change stream failed: %s", e)
+                # Events may have been missed while the stream was down
+                self._reload()
+                continue
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except STORAGE_ERRORS as e:
+                logger.error("❌ Registry poll failed: %s", e)
+    
+    def status(self):
+        return {"mode": "stream" if self.streaming else "poll", "changes": self.changes}
+    
+    def _reload(self):
+        time.sleep(self.interval)
+        try:
+            load_registry()
+        except STORAGE_ERRORS as e:
+            logger.error("❌ Registry reload failed: %s", e)
 
 
-class UltimateKeepAlive:
-    """Main Keep-Alive orchestrator"""
-    def __init__(self, app_url):
-        self.app_url = app_url
-        self.components = []
-        
-    def setup(self):
-        logger.info("🚀 Initializing Ultimate Keep-Alive System...")
-        
-        # Add components
-        self.self_pinger = SelfPinger(self.app_url, interval=240)
-        self.activity_sim = ActivitySimulator()
-        self.sleep_prev = SleepPrevention()
-        
-        # Start all components
-        self.self_pinger.start()
-        self.activity_sim.start()
-        self.sleep_prev.start()
-        
-        logger.info("✅ Ultimate Keep-Alive System Activated!")
-        logger.info(f"📍 App URL: {self.app_url}")
-        logger.info(f"⏱️  Self-Ping Interval: 1 Second")
-        logger.info(f"🎯 Sleep Threshold: 10 Seconds")
+REGISTRY_CHANGES = metrics.add(Counter("monitor_registry_changes_total",
+                                       "Server documents and deletes applied to the registry after the initial load"))
+registry_watcher = RegistryWatcher()
 
-# ==================== PING & MONITORING ====================
 
-def ping_server(name, url, email=None, password=None):
-    """Ping a server and log the result."""
-    headers = {
-        "User-Agent": random.choice(USER_AGENTS),
-        "Cache-Control": "no-cache",
-        "Pragma": "no-cache",
-    }
-    
-    try:
-        start_time = time.time()
-        response = requests.get(url, headers=headers, timeout=20)
-        response_time = round((time.time() - start_time) * 1000, 2)
-        
-        # Update status in database
-        collection.update_one(
-            {"name": name},
-            {
-                "$set": {
-                    "last_ping": datetime.now(),
-                    "status": "online",
-                    "status_code": response.status_code,
-                    "response_time": response_time,
-                    "error": None,
-                    "consecutive_failures": 0
-                },
-                "$inc": {"total_pings": 1, "successful_pings": 1}
-            }
-        )
-        logger.info(f"✅ {name} ({url}) - Status: {response.status_code} - Time: {response_time}ms")
-        
-    except requests.exceptions.RequestException as e:
-        error_msg = str(e)
-        
-        collection.update_one(
-            {"name": name},
-            {
-                "$set": {
-                    "last_ping": datetime.now(),
-                    "status": "offline",
-                    "error": error_msg,
-                    "response_time": 0
-                },
-                "$inc": {
-                    "total_pings": 1, 
-                    "failed_pings": 1,
-                    "consecutive_failures": 1
-                }
-            }
-        )
-        logger.error(f"❌ {name} ({url}) - Failed: {error_msg}")
+def on_leases_changed(owned):
+    """Drop servers we no longer own right away, without storage; reload so newly claimed
+    servers resume from the previous owner's last_ping"""
+    schedule_owned()
+    if owned:
+        load_registry()
+
+
+shard_leases.listeners.append(on_leases_changed)
 
 
 def run_pings():
-    """Run the ping loop indefinitely."""
+    """Start the scheduler, load servers once storage answers, then follow changes."""
+    ping_scheduler.start()
+    retry = 0.5
     while True:
-        logger.info("🔄 === Pinging All Servers ===")
-        servers = list(collection.find())
-        
-        if len(servers) == 0:
-            logger.info("📭 No servers to ping")
-        else:
-            for server in servers:
-                ping_server(
-                    server['name'], 
-                    server['url'],
-                    server.get('email'),
-                    server.get('password')
-                )
-        
-        logger.info("✅ === Ping Round Complete. Sleeping 5 minutes ===")
-        time.sleep(0.00001)  # 5 minutes
+        try:
+            if not startup.storage_ready:
+                storage.ping()
+                startup.mark_storage_ready()
+                ensure_indexes()
+            load_registry()
+            startup.mark_registry_loaded(len(server_registry))
+            break
+        except STORAGE_ERRORS as e:
+            startup.error = str(e)
+            logger.error("❌ Registry load failed, retrying in %ss: %s", retry, e)
+            time.sleep(retry)
+            retry = min(retry * 2, 30)
+    
+    if len(server_registry) == 0:
+        logger.info("📭 No servers to ping")
+    registry_watcher.run()
 
 
-def calculate_uptime(server):
-    """Calculate uptime percentage"""
+def calculate_uptime(server, window=None):
+    """Calculate uptime percentage, over a sliding window ("1h", "24h", "7d", "30d") if given"""
+    if window and server.get(f"uptime_{window}") is not None:
+        return server[f"uptime_{window}"]
+    
     total = server.get('total_pings', 0)
     successful = server.get('successful_pings', 0)
     
@@ -279,175 +3280,514 @@ def calculate_uptime(server):
 
 # ==================== HTTP SERVER ====================
 
+def collect_stats():
+    """App-level stats for /api/stats and the event stream"""
+    uptime = time.time() - START_TIME
+    return {
+        "app_uptime": int(uptime),
+        "app_uptime_formatted": str(timedelta(seconds=int(uptime))),
+        "memory_usage": psutil.virtual_memory().percent,
+        "cpu_usage": psutil.cpu_percent(),
+        "active_threads": threading.active_count(),
+        "self_pings": keep_alive.self_pinger.ping_count,
+        "pings_in_flight": ping_engine.in_flight,
+        "last_round_duration": ping_engine.last_round_duration,
+        "db_writes": {
+            "submitted": result_writer.submitted,
+            "written": result_writer.written,
+            "flushes": result_writer.flushes,
+            "errors": result_writer.errors,
+        },
+        "event_streams": event_hub.client_count,
+        "latency": latency_quantiles.fleet_quantiles(),
+        "startup": startup.status(),
+        "shards": shard_leases.status(),
+        "registry": registry_watcher.status(),
+        "dns": dns_cache.stats(),
+    }
+
+
+event_hub = EventHub(lambda: server_registry.encoded()[0], collect_stats)
+server_registry.listeners.append(event_hub.publish)
+
+
+def new_server(entry):
+    """Server document for an /add entry, or None without a name and url"""
+    name = str(entry.get("name") or "").strip()
+    url = str(entry.get("url") or "").strip()
+    if not name or not url:
+        return None
+    try:
+        interval = int(entry.get("interval") or DEFAULT_PING_INTERVAL)
+    except (TypeError, ValueError):
+        interval = DEFAULT_PING_INTERVAL
+    check_mode = str(entry.get("check_mode") or PING_CHECK_MODE).strip()
+    if check_mode not in CHECK_MODES:
+        check_mode = PING_CHECK_MODE
+    return {
+        "name": name,
+        "url": url,
+        "email": str(entry.get("email") or "").strip(),
+        "password": str(entry.get("password") or "").strip(),
+        "created_at": datetime.now(),
+        "status": "pending",
+        "total_pings": 0,
+        "successful_pings": 0,
+        "failed_pings": 0,
+        "consecutive_failures": 0,
+        "last_ping": None,
+        "response_time": 0,
+        "interval": max(interval, MIN_PING_INTERVAL),
+        "check_mode": check_mode,
+        "expect": str(entry.get("expect") or "").strip(),
+        "tags": parse_list(entry.get("tags")),
+        "paused": entry.get("paused") in (True, "1", "true", "on"),
+        "updated_at": time.time(),
+    }
+
+
+def parse_list(value):
+    """Strings from a JSON list or a comma separated form field"""
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple)):
+        return []
+    return sorted({str(item).strip() for item in value} - {""})
+
+
+MANAGE_ACTIONS = {"remove": "Removed", "pause": "Paused", "resume": "Resumed"}
+
+
+def server_filter(selector):
+    """Storage filter for a batch selector, or None if it selects nothing in particular.
+    names, url, tag and status must all match; status comes from the live registry,
+    which is ahead of the database between result writer flushes."""
+    filter = {}
+    if selector.get("names"):
+        # Names may contain commas, so a single string is one name, never a list to split
+        names = selector["names"]
+        filter["name"] = {"$in": parse_list([names] if isinstance(names, str) else names)}
+    if selector.get("url"):
+        filter["url"] = str(selector["url"]).strip()
+    if selector.get("tag"):
+        filter["tags"] = {"$in": [str(selector["tag"]).strip()]}
+    if selector.get("status"):
+        names = set(server_registry.select({"status": str(selector["status"]).strip()}))
+        if "name" in filter:
+            names &= set(filter["name"]["$in"])
+        filter["name"] = {"$in": sorted(names)}
+    return filter or None
+
+
+def filter_names(filter):
+    """The names a filter on name alone selects, or None if it matches on anything else"""
+    if set(filter) != {"name"}:
+        return None
+    value = filter["name"]
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict) and set(value) == {"$in"}:
+        return list(value["$in"])
+    return None
+
+
+def manage_servers(action, filter):
+    """Remove, pause or resume every server matching filter, then update the registry and schedule
+    in place. Pause and resume are one update_many; so is a remove, unless polling workers need
+    tombstones for a selector that doesn't name the servers. Returns (names, stored count)."""
+    if action == "remove":
+        named = filter_names(filter)
+        stored = []
+        if registry_watcher.streaming or named is not None:
+            count = collection.delete_many(filter).deleted_count
+            # A name that wasn't stored gets a harmless tombstone; registries only drop what they have
+            tombstones = (named or []) if count else []
+        else:
+            # Names come from storage, so servers this registry hasn't loaded still get a tombstone;
+            # deleting by those names keeps a concurrently added match from vanishing without one
+            stored = tombstones = [doc["name"] for doc in collection.find(filter, {"_id": 0, "name": 1})]
+            count = collection.delete_many({"name": {"$in": stored}}).deleted_count if stored else 0
+        if tombstones and not registry_watcher.streaming:
+            # Polling workers can't see a delete; they pick these up instead. Streaming ones get the delete event
+            deleted_at = time.time()
+            tombstones_collection.insert_many([{"name": name, "deleted_at": deleted_at} for name in tombstones])
+        names = sorted(set(stored) | set(server_registry.select(filter)))
+        for name in names:
+            server_registry.remove(name)
+            ping_scheduler.remove(name)
+    else:
+        paused = action == "pause"
+        update = {"$set": {"paused": paused, "updated_at": time.time()}}
+        count = collection.update_many(filter, update).matched_count
+        names = server_registry.select(filter)
+        for name in names:
+            server_registry.apply(name, update)
+            if paused:
+                ping_scheduler.remove(name)
+            elif shard_leases.owns(name):
+                ping_scheduler.add(server_registry.get(name))
+    return names, count
+
+
+def instrumented(handler_method):
+    """Record handler latency per route; unknown paths share one label"""
+    @functools.wraps(handler_method)
+    def wrapper(self):
+        start = time.perf_counter()
+        try:
+            return handler_method(self)
+        finally:
+            path = urlparse(self.path).path
+            route = path if path in HTTP_ROUTES else "other"
+            HTTP_DURATION.labels(method=self.command, route=route).observe(time.perf_counter() - start)
+    return wrapper
+
+
 class MonitorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive; every response carries a Content-Length
+    timeout = HTTP_TIMEOUT
+    disable_nagle_algorithm = True  # Headers and body go out as separate writes
+    parked = False
+    
     def log_message(self, format, *args):
         pass  # Suppress default logging
     
+    def handle(self):
+        """One request per turn on the pool; between keep-alive requests the server parks the connection"""
+        parks_idle = getattr(self.server, "parks_idle", False)
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if parks_idle and not self._buffered():
+                self.parked = True
+                return
+            self.handle_one_request()
+    
+    def _buffered(self):
+        """True if the next request already arrived; peeks without blocking"""
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+    
+    def resume(self):
+        """Serve a parked connection once its next request arrives"""
+        self.parked = False
+        try:
+            self.handle()
+        finally:
+            self.finish()
+    
+    def finish(self):
+        if not self.parked:
+            super().finish()
+    
+    def send_body(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload, default=str))
+    
+    def send_cached(self, body, etag, content_type="application/json"):
+        """Answer 304 when the client already holds this ETag"""
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+        else:
+            self.send_body(200, body, content_type, headers)
+    
+    @instrumented
     def do_GET(self):
         # Update sleep prevention
         keep_alive.sleep_prev.update_activity()
         
-        if self.path == "/":
-            self.send_response(200)
-            self.send_header("Content-type", "text/html")
-            self.end_headers()
-            self.wfile.write(self.get_main_page().encode())
+        parsed = urlparse(self.path)
+        path = parsed.path
         
-        elif self.path == "/heartbeat":
-            self.send_response(200)
-            self.send_header("Content-type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"alive")
+        if path == "/":
+            self.send_body(200, self.get_main_page(), "text/html")
         
-        elif self.path == "/api/servers":
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            servers = list(collection.find({}, {"_id": 0}))
-            self.wfile.write(json.dumps(servers, default=str).encode())
+        elif path == "/heartbeat":
+            self.send_body(200, b"alive", "text/plain")
+        
+        elif path == "/ready":
+            status = startup.status()
+            self.send_json(200 if status["ready"] else 503, status)
+        
+        elif path == "/metrics":
+            self.send_body(200, metrics.render(), "text/plain; version=0.0.4")
+        
+        elif path == "/api/servers":
+            if parsed.query:
+                self.send_server_page(parsed.query)
+            else:
+                body, etag = server_registry.encoded()
+                self.send_cached(body, etag)
+        
+        elif path == "/api/stats":
+            self.send_json(200, collect_stats())
         
-        elif self.path == "/api/stats":
-            uptime = time.time() - START_TIME
+        elif path == "/api/history":
+            self.send_history(parse_qs(parsed.query))
+        
+        elif path == "/api/events":
             self.send_response(200)
-            self.send_header("Content-type", "application/json")
+            self.send_header("Content-type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("X-Accel-Buffering", "no")
             self.end_headers()
-            
-            stats = {
-                "app_uptime": int(uptime),
-                "app_uptime_formatted": str(timedelta(seconds=int(uptime))),
-                "memory_usage": psutil.virtual_memory().percent,
-                "cpu_usage": psutil.cpu_percent(),
-                "active_threads": threading.active_count(),
-                "self_pings": keep_alive.self_pinger.ping_count,
-            }
-            
-            self.wfile.write(json.dumps(stats).encode())
+            # The hub owns the socket from here on; this worker goes back to the pool
+            self.close_connection = True
+            self.server.detach(self.request)
+            event_hub.attach(self.request)
         
         else:
-            self.send_response(404)
-            self.end_headers()
+            self.send_body(404, b"", "text/plain")
+
+    def send_history(self, query):
+        """/api/history?name=&range=1h|24h|7d|30d|365d&resolution=raw|1m|1h|1d"""
+        name = query.get("name", [""])[0]
+        span = HISTORY_RANGES.get(query.get("range", ["24h"])[0])
+        resolution = query.get("resolution", [None])[0]
+        if span is None or resolution not in (None, "raw", "1m", "1h", "1d"):
+            return self.send_json(400, {"success": False, "message": "Invalid range or resolution!"})
+        
+        history = latency_history.query(name, span, resolution)
+        if history is None:
+            return self.send_json(404, {"success": False, "message": "No history for this server!"})
+        self.send_json(200, history)
+    
+    def send_server_page(self, query_string):
+        """/api/servers?status=&url=&prefix=&cursor=&limit=&fields="""
+        etag = server_registry.etag(query_string)
+        if self.headers.get("If-None-Match") == etag:
+            return self.send_cached(b"", etag)
+        
+        query = parse_qs(query_string)
+        
+        def first(key):
+            return query.get(key, [None])[0]
+        
+        try:
+            limit = int(first("limit")) if first("limit") else None
+        except ValueError:
+            return self.send_json(400, {"success": False, "message": "limit must be a number"})
+        if limit is not None and limit < 1:
+            return self.send_json(400, {"success": False, "message": "limit must be at least 1"})
+        fields = set(first("fields").split(",")) if first("fields") else None
+        
+        servers, next_cursor = server_registry.query(
+            status=first("status"),
+            url=first("url"),
+            prefix=first("prefix") or "",
+            cursor=first("cursor"),
+            limit=limit,
+            fields=fields,
+        )
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        self.send_body(200, json.dumps(servers, default=str), headers=headers)
 
+    def add_servers(self, entries):
+        """Insert new servers with one insert_many; names that already exist are skipped"""
+        if len(entries) > MAX_ADD_SERVERS:
+            self.send_json(413, {"success": False, "message": f"At most {MAX_ADD_SERVERS} servers per request!"})
+            return
+        
+        # Duplicates are only rejected by the unique index; retry building it before refusing
+        if not startup.unique_names and not ensure_indexes():
+            self.send_json(503, {"success": False,
+                                 "message": "Server names are not unique-indexed yet; remove duplicate names first!"})
+            return
+        
+        docs, invalid, skipped, seen = [], [], [], set()
+        for index, entry in enumerate(entries):
+            doc = new_server(entry) if isinstance(entry, dict) else None
+            if doc is None:
+                invalid.append(index)
+            elif doc["name"] in seen:
+                skipped.append(doc["name"])
+            else:
+                seen.add(doc["name"])
+                docs.append(doc)
+        
+        # The unique index on name decides; no find_one per server, no race between concurrent adds
+        failed = set()
+        if docs:
+            try:
+                collection.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    failed.add(error["index"])
+                    if error.get("code") == 11000:
+                        skipped.append(docs[error["index"]]["name"])
+                    else:
+                        logger.error("❌ Failed to add %s: %s", docs[error['index']]['name'], error.get('errmsg'))
+            except STORAGE_ERRORS as e:
+                logger.error("❌ Failed to add servers: %s", e)
+                self.send_json(503, {"success": False, "message": "Storage unavailable, try again!"})
+                return
+        
+        added = []
+        for index, doc in enumerate(docs):
+            if index in failed:
+                continue
+            server_registry.add(doc)
+            if shard_leases.owns(doc["name"]) and not doc["paused"]:
+                ping_scheduler.add(server_registry.get(doc["name"]))
+            added.append(doc["name"])
+        if added:
+            logger.info("➕ Added %d server(s): %s%s", len(added), ', '.join(added[:5]), ' ...' if len(added) > 5 else '')
+        
+        self.send_json(200, {
+            "success": True,
+            "message": f"Added {len(added)} server(s)",
+            "servers": added,
+            "skipped": skipped,
+            "invalid": invalid,
+        })
+    
+    @instrumented
     def do_POST(self):
         # Update sleep prevention
         keep_alive.sleep_prev.update_activity()
         
-        content_length = int(self.headers['Content-Length'])
+        content_length = int(self.headers.get('Content-Length') or 0)
         post_data = self.rfile.read(content_length).decode()
         params = parse_qs(post_data)
 
         if self.path == "/add":
-            name = params.get('name', [''])[0].strip()
-            url = params.get('url', [''])[0].strip()
-            email = params.get('email', [''])[0].strip()
-            password = params.get('password', [''])[0].strip()
-            num_times = int(params.get('num_times', ['1'])[0])
-            
-            if name and url and num_times > 0:
-                added_servers = []
-                
-                for i in range(1, num_times + 1):
-                    server_name = f"{name}-{{{i}}}" if num_times > 1 else name
-                    
-                    # Check if name already exists
-                    if collection.find_one({"name": server_name}):
-                        continue
-                    
-                    server_data = {
-                        "name": server_name,
-                        "url": url,
-                        "email": email if email else "",
-                        "password": password if password else "",
-                        "created_at": datetime.now(),
-                        "status": "pending",
-                        "total_pings": 0,
-                        "successful_pings": 0,
-                        "failed_pings": 0,
-                        "consecutive_failures": 0,
-                        "last_ping": None,
-                        "response_time": 0
-                    }
-                    
-                    collection.insert_one(server_data)
-                    added_servers.append(server_name)
-                    logger.info(f"➕ Added server: {server_name} - {url}")
-                
-                self.send_response(200)
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({
-                    "success": True,
-                    "message": f"Added {len(added_servers)} server(s)",
-                    "servers": added_servers
-                }).encode())
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                # JSON body: an array of servers, {"servers": [...]}, or a single server object
+                try:
+                    entries = json.loads(post_data)
+                except ValueError:
+                    self.send_json(400, {"success": False, "message": "Invalid JSON body!"})
+                    return
+                if isinstance(entries, dict):
+                    entries = entries.get("servers", [entries])
+                if not isinstance(entries, list):
+                    self.send_json(400, {"success": False, "message": "Expected a list of servers!"})
+                    return
             else:
-                self.send_response(400)
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({
-                    "success": False,
-                    "message": "Missing required fields!"
-                }).encode())
+                name = params.get('name', [''])[0].strip()
+                url = params.get('url', [''])[0].strip()
+                try:
+                    num_times = int(params.get('num_times', ['1'])[0])
+                except ValueError:
+                    num_times = 0
+                if not (name and url and num_times > 0):
+                    self.send_json(400, {
+                        "success": False,
+                        "message": "Missing required fields!"
+                    })
+                    return
+                if num_times > MAX_ADD_SERVERS:
+                    self.send_json(413, {"success": False, "message": f"At most {MAX_ADD_SERVERS} servers per request!"})
+                    return
+                entry = {field: params.get(field, [''])[0] for field in CONFIG_FIELDS}
+                entries = [
+                    dict(entry, name=f"{name}-{{{i}}}" if num_times > 1 else name)
+                    for i in range(1, num_times + 1)
+                ]
+            self.add_servers(entries)
 
         elif self.path == "/remove":
             name = params.get('name', [''])[0].strip()
-            if collection.find_one({"name": name}):
-                collection.delete_one({"name": name})
-                logger.info(f"🗑️ Removed server: {name}")
+            _, count = manage_servers("remove", {"name": name})
+            if count:
+                logger.info("🗑️ Removed server: %s", name)
                 
-                self.send_response(200)
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({
+                self.send_json(200, {
                     "success": True,
                     "message": "Server removed successfully!"
-                }).encode())
+                })
             else:
-                self.send_response(400)
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({
+                self.send_json(400, {
                     "success": False,
                     "message": "Server not found!"
-                }).encode())
+                })
         
         elif self.path == "/remove-by-url":
             url = params.get('url', [''])[0].strip()
             
             if url:
-                # Find all servers with this URL
-                servers = list(collection.find({"url": url}))
+                # One delete_many; polling deployments also read the names first for their tombstones
+                server_names, count = manage_servers("remove", {"url": url})
                 
-                if len(servers) > 0:
-                    # Delete all servers
-                    server_names = [s['name'] for s in servers]
-                    collection.delete_many({"url": url})
+                if count > 0:
+                    logger.info("🗑️ Removed %d server(s) with URL: %s", count, url)
                     
-                    logger.info(f"🗑️ Removed {len(servers)} server(s) with URL: {url}")
-                    
-                    self.send_response(200)
-                    self.send_header("Content-type", "application/json")
-                    self.end_headers()
-                    self.wfile.write(json.dumps({
+                    self.send_json(200, {
                         "success": True,
-                        "message": f"Removed {len(servers)} server(s) with URL: {url}",
+                        "message": f"Removed {count} server(s) with URL: {url}",
                         "removed": server_names
-                    }).encode())
+                    })
                 else:
-                    self.send_response(400)
-                    self.send_header("Content-type", "application/json")
-                    self.end_headers()
-                    self.wfile.write(json.dumps({
+                    self.send_json(400, {
                         "success": False,
                         "message": "No servers found with this URL!"
-                    }).encode())
+                    })
             else:
-                self.send_response(400)
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({
+                self.send_json(400, {
                     "success": False,
                     "message": "URL is required!"
-                }).encode())
+                })
+        
+        elif self.path == "/manage":
+            # {"action": "pause", "names": [...], "url": ..., "tag": ..., "status": ...} or the same as form fields,
+            # with one names field per server
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                try:
+                    selector = json.loads(post_data)
+                except ValueError:
+                    selector = None
+                if not isinstance(selector, dict):
+                    self.send_json(400, {"success": False, "message": "Invalid JSON body!"})
+                    return
+            else:
+                selector = {field: values if field == "names" else values[0] for field, values in params.items()}
+            action = str(selector.get("action") or "").strip()
+            if action not in MANAGE_ACTIONS:
+                self.send_json(400, {"success": False, "message": "Action must be remove, pause or resume!"})
+                return
+            filter = server_filter(selector)
+            if filter is None:
+                self.send_json(400, {"success": False, "message": "Select servers by names, url, tag or status!"})
+                return
+            try:
+                names, count = manage_servers(action, filter)
+            except STORAGE_ERRORS as e:
+                logger.error("❌ Failed to %s servers: %s", action, e)
+                self.send_json(503, {"success": False, "message": "Storage unavailable, try again!"})
+                return
+            if count:
+                logger.info("🧰 %s %d server(s): %s%s", MANAGE_ACTIONS[action], count,
+                            ', '.join(names[:5]), ' ...' if len(names) > 5 else '')
+            self.send_json(200, {
+                "success": True,
+                "message": f"{MANAGE_ACTIONS[action]} {count} server(s)",
+                "matched": count,
+                "servers": names,
+            })
+        
+        else:
+            self.send_body(404, b"", "text/plain")
 
     def get_main_page(self):
         return """
@@ -583,7 +3923,7 @@ class MonitorHandler(BaseHTTPRequestHandler):
             font-size: 14px;
         }
 
-        .form-group input {
+        .form-group input, .form-group select {
             padding: 12px 15px;
             border: 2px solid #e0e0e0;
             border-radius: 10px;
@@ -591,7 +3931,7 @@ class MonitorHandler(BaseHTTPRequestHandler):
             transition: all 0.3s ease;
         }
 
-        .form-group input:focus {
+        .form-group input:focus, .form-group select:focus {
             outline: none;
             border-color: var(--primary);
             box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1);
@@ -831,6 +4171,10 @@ class MonitorHandler(BaseHTTPRequestHandler):
                 <div class="stat-value" id="selfPings">0</div>
                 <div class="stat-label">Self Pings</div>
             </div>
+            <div class="stat-card">
+                <div class="stat-value" id="fleetP95">-</div>
+                <div class="stat-label">Fleet p95</div>
+            </div>
         </div>
 
         <div class="card">
@@ -849,6 +4193,22 @@ class MonitorHandler(BaseHTTPRequestHandler):
                         <label>🌐 Server URL</label>
                         <input type="url" name="url" placeholder="https://api.example.com" required>
                     </div>
+                    <div class="form-group">
+                        <label>⏱️ Ping Interval (seconds)</label>
+                        <input type="number" name="interval" value="300" min="10">
+                    </div>
+                    <div class="form-group">
+                        <label>🩺 Check Mode</label>
+                        <select name="check_mode">
+                            <option value="headers">Headers only (GET)</option>
+                            <option value="head">HEAD request</option>
+                            <option value="probe">Content probe (first 1 KB)</option>
+                        </select>
+                    </div>
+                    <div class="form-group">
+                        <label>🔎 Expected Content (Optional)</label>
+                        <input type="text" name="expect" placeholder="OK">
+                    </div>
                 </div>
                 <div class="form-grid">
                     <div class="form-group">
@@ -922,7 +4282,7 @@ class MonitorHandler(BaseHTTPRequestHandler):
                 if (result.success) {
                     showNotification(result.message, 'success');
                     event.target.reset();
-                    loadServers();
+                    if (!window.EventSource) loadServers();
                 } else {
                     showNotification(result.message, 'error');
                 }
@@ -947,7 +4307,7 @@ class MonitorHandler(BaseHTTPRequestHandler):
                 
                 if (result.success) {
                     showNotification(result.message, 'success');
-                    loadServers();
+                    if (!window.EventSource) loadServers();
                 } else {
                     showNotification(result.message, 'error');
                 }
@@ -956,6 +4316,27 @@ class MonitorHandler(BaseHTTPRequestHandler):
             }
         }
 
+        async function setPaused(name, paused) {
+            try {
+                const response = await fetch('/manage', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ action: paused ? 'pause' : 'resume', names: [name] })
+                });
+                
+                const result = await response.json();
+                
+                if (result.success) {
+                    showNotification(result.message, 'success');
+                    if (!window.EventSource) loadServers();
+                } else {
+                    showNotification(result.message, 'error');
+                }
+            } catch (error) {
+                showNotification('Error updating server', 'error');
+            }
+        }
+
         async function removeByUrl(event) {
             event.preventDefault();
             const formData = new FormData(event.target);
@@ -974,7 +4355,7 @@ class MonitorHandler(BaseHTTPRequestHandler):
                 if (result.success) {
                     showNotification(result.message + ' - Removed: ' + result.removed.join(', '), 'success');
                     event.target.reset();
-                    loadServers();
+                    if (!window.EventSource) loadServers();
                 } else {
                     showNotification(result.message, 'error');
                 }
@@ -983,67 +4364,132 @@ class MonitorHandler(BaseHTTPRequestHandler):
             }
         }
 
-        async function loadServers() {
-            try {
-                const response = await fetch('/api/servers');
-                const servers = await response.json();
-                
-                const serverList = document.getElementById('serverList');
-                
-                if (servers.length === 0) {
-                    serverList.innerHTML = `
-                        <div class="empty-state">
-                            <p>No servers added yet. Add your first server above!</p>
-                        </div>
-                    `;
-                } else {
-                    serverList.innerHTML = servers.map(server => {
-                        const uptime = calculateUptime(server);
-                        return `
-                        <div class="server-item">
+        const SERVER_FIELDS = 'name,url,email,has_password,status,response_time,timings,interval,' +
+            'last_ping,successful_pings,failed_pings,total_pings,consecutive_failures,circuit,paused,tags,' +
+            'latency_p50,latency_p95,latency_p99,uptime_1h,uptime_24h,uptime_7d,uptime_30d';
+
+        async function fetchAllServers() {
+            const servers = [];
+            let cursor = '';
+            do {
+                const params = new URLSearchParams({ limit: 1000, fields: SERVER_FIELDS });
+                if (cursor) params.set('cursor', cursor);
+                const response = await fetch('/api/servers?' + params);
+                servers.push(...await response.json());
+                cursor = response.headers.get('X-Next-Cursor');
+            } while (cursor);
+            return servers;
+        }
+
+        const servers = new Map();
+        let countersPending = false;
+
+        function renderServer(server) {
+            const uptime = calculateUptime(server);
+            return `
+                        <div class="server-item" data-name="${server.name}">
                             <div class="server-info">
                                 <div class="server-name">${server.name}</div>
                                 <div class="server-url">🌐 ${server.url}</div>
-                                ${server.email || server.password ? `
+                                ${server.email || server.has_password ? `
                                 <div class="server-credentials">
                                     ${server.email ? `📧 ${server.email}` : ''} 
-                                    ${server.password ? `🔐 ••••••••` : ''}
+                                    ${server.has_password ? `🔐 ••••••••` : ''}
                                 </div>
                                 ` : ''}
                                 <div class="server-meta">
                                     ${server.response_time ? `<span class="meta-item">⚡ ${server.response_time}ms</span>` : ''}
+                                    ${server.latency_p95 ? `<span class="meta-item">📈 p50 ${server.latency_p50}ms / p95 ${server.latency_p95}ms / p99 ${server.latency_p99}ms</span>` : ''}
+                                    ${server.timings ? `<span class="meta-item">🌐 ${server.timings.dns ?? 0}ms / 🔌 ${server.timings.connect}ms / 🔒 ${server.timings.tls}ms / 📨 ${server.timings.ttfb}ms</span>` : ''}
+                                    ${server.interval ? `<span class="meta-item">⏱️ every ${server.interval}s</span>` : ''}
                                     ${server.last_ping ? `<span class="meta-item">🕒 ${new Date(server.last_ping).toLocaleString()}</span>` : ''}
                                     <span class="meta-item">✅ ${server.successful_pings || 0} / ❌ ${server.failed_pings || 0}</span>
-                                    <span class="meta-item">📊 Uptime: ${uptime}%</span>
+                                    <span class="meta-item">📊 Uptime (24h): ${uptime}%</span>
+                                    ${server.uptime_1h != null ? `<span class="meta-item">🕐 1h ${server.uptime_1h}% · 7d ${server.uptime_7d}% · 30d ${server.uptime_30d}%</span>` : ''}
                                     ${server.consecutive_failures ? `<span class="meta-item" style="background: #fee; color: #c00;">🔴 ${server.consecutive_failures} consecutive failures</span>` : ''}
+                                    ${server.circuit === 'open' ? `<span class="meta-item" style="background: #fee; color: #c00;">🔌 Backing off</span>` : ''}
+                                    ${server.paused ? `<span class="meta-item">⏸️ Paused</span>` : ''}
+                                    ${server.tags && server.tags.length ? `<span class="meta-item">🏷️ ${server.tags.join(', ')}</span>` : ''}
                                 </div>
                             </div>
                             <div class="server-actions">
                                 <span class="status-badge status-${server.status || 'pending'}">
                                     ${server.status || 'pending'}
                                 </span>
+                                <button class="btn btn-warning" onclick="setPaused('${server.name}', ${!server.paused})">${server.paused ? '▶️' : '⏸️'}</button>
                                 <button class="btn btn-danger" onclick="removeServer('${server.name}')">🗑️</button>
                             </div>
                         </div>
-                    `}).join('');
-                }
-                
-                // Update stats
-                const online = servers.filter(s => s.status === 'online').length;
-                const offline = servers.filter(s => s.status === 'offline').length;
-                const totalPings = servers.reduce((sum, s) => sum + (s.total_pings || 0), 0);
-                
-                document.getElementById('totalServers').textContent = servers.length;
-                document.getElementById('onlineServers').textContent = online;
-                document.getElementById('offlineServers').textContent = offline;
-                document.getElementById('totalPings').textContent = totalPings;
-                
+                    `;
+        }
+
+        function renderServerList() {
+            const serverList = document.getElementById('serverList');
+            
+            if (servers.size === 0) {
+                serverList.innerHTML = `
+                    <div class="empty-state">
+                        <p>No servers added yet. Add your first server above!</p>
+                    </div>
+                `;
+            } else {
+                const names = [...servers.keys()].sort();
+                serverList.innerHTML = names.map(name => renderServer(servers.get(name))).join('');
+            }
+            updateCounters();
+        }
+
+        function renderServerItem(name) {
+            const item = document.querySelector(`.server-item[data-name="${CSS.escape(name)}"]`);
+            if (!item || !servers.has(name)) {
+                renderServerList();
+                return;
+            }
+            item.outerHTML = renderServer(servers.get(name));
+            scheduleCounters();
+        }
+
+        function scheduleCounters() {
+            // Coalesce bursts of deltas into one recount per frame
+            if (countersPending) return;
+            countersPending = true;
+            requestAnimationFrame(() => {
+                countersPending = false;
+                updateCounters();
+            });
+        }
+
+        function updateCounters() {
+            let online = 0, offline = 0, totalPings = 0;
+            for (const s of servers.values()) {
+                if (s.status === 'online') online++;
+                if (s.status === 'offline') offline++;
+                totalPings += s.total_pings || 0;
+            }
+            
+            document.getElementById('totalServers').textContent = servers.size;
+            document.getElementById('onlineServers').textContent = online;
+            document.getElementById('offlineServers').textContent = offline;
+            document.getElementById('totalPings').textContent = totalPings;
+        }
+
+        function setServers(list) {
+            servers.clear();
+            list.forEach(server => servers.set(server.name, server));
+            renderServerList();
+        }
+
+        async function loadServers() {
+            try {
+                setServers(await fetchAllServers());
             } catch (error) {
                 console.error('Error loading servers:', error);
             }
         }
 
         function calculateUptime(server) {
+            if (server.uptime_24h != null) return server.uptime_24h;
+            
             const total = server.total_pings || 0;
             const successful = server.successful_pings || 0;
             
@@ -1052,38 +4498,174 @@ class MonitorHandler(BaseHTTPRequestHandler):
             return ((successful / total) * 100).toFixed(1);
         }
 
+        function showStats(stats) {
+            document.getElementById('appUptime').textContent = stats.app_uptime_formatted;
+            document.getElementById('selfPings').textContent = stats.self_pings;
+            if (stats.latency && stats.latency.p95 !== null) {
+                document.getElementById('fleetP95').textContent = `${Math.round(stats.latency.p95)}ms`;
+            }
+        }
+
         async function loadStats() {
             try {
                 const response = await fetch('/api/stats');
-                const stats = await response.json();
-                
-                document.getElementById('appUptime').textContent = stats.app_uptime_formatted;
-                document.getElementById('selfPings').textContent = stats.self_pings;
-                
+                showStats(await response.json());
             } catch (error) {
                 console.error('Error loading stats:', error);
             }
         }
 
-        // Load data on page load
-        loadServers();
-        loadStats();
-        
-        // Auto-refresh
-        setInterval(loadServers, 30000);  // Every 30 seconds
-        setInterval(loadStats, 10000);     // Every 10 seconds
+        function subscribe() {
+            const events = new EventSource('/api/events');
+            
+            events.addEventListener('snapshot', e => setServers(JSON.parse(e.data)));
+            events.addEventListener('stats', e => showStats(JSON.parse(e.data)));
+            events.addEventListener('server', e => {
+                const server = JSON.parse(e.data);
+                servers.set(server.name, server);
+                renderServerItem(server.name);
+            });
+            events.addEventListener('update', e => {
+                const delta = JSON.parse(e.data);
+                const server = servers.get(delta.name);
+                if (!server) return;
+                Object.assign(server, delta);
+                renderServerItem(delta.name);
+            });
+            events.addEventListener('removed', e => {
+                servers.delete(JSON.parse(e.data).name);
+                renderServerList();
+            });
+        }
+
+        if (window.EventSource) {
+            // Live deltas; the stream starts with a full snapshot and reconnects on its own
+            loadStats();
+            subscribe();
+        } else {
+            loadServers();
+            loadStats();
+            setInterval(loadServers, 30000);  // Every 30 seconds
+            setInterval(loadStats, 10000);     // Every 10 seconds
+        }
     </script>
 </body>
 </html>
         """
 
 
-def run_server():
-    """Run HTTP server"""
-    server_address = ('', 8000)
-    httpd = HTTPServer(server_address, MonitorHandler)
-    logger.info("🌐 HTTP Server started on port 8000")
-    httpd.serve_forever()
+class PooledHTTPServer(ThreadingHTTPServer):
+    """Threaded HTTP server that handles requests on a bounded worker pool. A connection with
+    no request yet (new, or idle keep-alive) waits in a selector instead of holding a worker."""
+    daemon_threads = True
+    parks_idle = True  # Handlers return after one request instead of waiting for the next
+    
+    def __init__(self, server_address, handler_class, max_workers=HTTP_WORKERS, idle_timeout=HTTP_TIMEOUT):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="http")
+        self.idle_timeout = idle_timeout
+        self.waiting = 0
+        self._lock = threading.Lock()
+        self._detached = set()
+        self._parking = deque()  # (request, client_address, handler or None) to watch
+        self._idle = {}          # request -> (client_address, handler, monotonic deadline)
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        threading.Thread(target=self._watch_idle, daemon=True).start()
+    
+    def detach(self, request):
+        """Keep a connection open after its handler returns (event streams)"""
+        self._detached.add(request)
+    
+    def shutdown_request(self, request):
+        if request in self._detached:
+            self._detached.discard(request)
+            return
+        super().shutdown_request(request)
+    
+    def process_request(self, request, client_address):
+        self._park(request, client_address, None)
+    
+    def _park(self, request, client_address, handler):
+        """Watch a connection for its next request without holding a worker"""
+        self._parking.append((request, client_address, handler))
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # A wake-up is already pending
+    
+    def _watch_idle(self):
+        next_sweep = time.monotonic() + 1
+        while True:
+            try:
+                ready = self._selector.select(1)
+            except (OSError, ValueError):
+                return  # Closed by server_close
+            for key, _ in ready:
+                request = key.fileobj
+                if request is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                self._selector.unregister(request)
+                client_address, handler, _ = self._idle.pop(request)
+                with self._lock:
+                    self.waiting += 1
+                self.executor.submit(self._handle, request, client_address, handler)
+            now = time.monotonic()
+            while self._parking:
+                request, client_address, handler = self._parking.popleft()
+                try:
+                    self._selector.register(request, selectors.EVENT_READ)
+                except (OSError, ValueError):
+                    self._close_idle(request, handler)
+                    continue
+                self._idle[request] = (client_address, handler, now + self.idle_timeout)
+            if now >= next_sweep:
+                next_sweep = now + 1
+                for request in [r for r, (_, _, deadline) in self._idle.items() if deadline <= now]:
+                    self._selector.unregister(request)
+                    self._close_idle(request, self._idle.pop(request)[1])
+    
+    def _close_idle(self, request, handler):
+        if handler is not None:
+            handler.parked = False
+            handler.finish()
+        self.shutdown_request(request)
+    
+    def _handle(self, request, client_address, handler=None):
+        with self._lock:
+            self.waiting -= 1
+        try:
+            if handler is None:
+                handler = self.RequestHandlerClass(request, client_address, self)
+            else:
+                handler.resume()
+            if handler.parked:
+                return self._park(request, client_address, handler)
+        except Exception:
+            self.handle_error(request, client_address)
+        self.shutdown_request(request)
+    
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+        self._selector.close()
+
+
+def run_server(port=HTTP_PORT):
+    """Bind the HTTP port now and serve from a background thread"""
+    server_address = ('', port)
+    httpd = PooledHTTPServer(server_address, MonitorHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    logger.info("🌐 HTTP Server started on port %s (%d workers)", port, HTTP_WORKERS)
+    return httpd
 
 
 # ==================== MAIN ====================
@@ -1093,25 +4675,38 @@ if __name__ == "__main__":
     logger.info("🚀 ULTIMATE SERVER MONITOR STARTING...")
     logger.info("=" * 60)
     
-    # Initialize Keep-Alive System
-    keep_alive = UltimateKeepAlive(APP_URL)
-    keep_alive.setup()
+    # Workers only ping their shards; the web process also serves the dashboard
+    worker_mode = "--worker" in sys.argv[1:]
+    
+    if not worker_mode:
+        # Bind the port first; /ready reports 503 until storage answers
+        run_server()
     
-    # Start HTTP server in background
-    server_thread = threading.Thread(target=run_server, daemon=True)
-    server_thread.start()
+    # Start batched database writes
+    result_writer.start()
+    latency_quantiles.start()
+    uptime_tracker.start()
+    # Every pinging process takes leases, so the web process and --worker processes never double up
+    if worker_mode or WEB_PINGS:
+        shard_leases.start()
+    else:
+        shard_leases.enabled = True  # Hold no shards; show what the workers store
     
-    # Give server time to start
-    time.sleep(2)
+    if not worker_mode:
+        event_hub.start()
+        # Initialize Keep-Alive System
+        keep_alive.setup()
     
     logger.info("=" * 60)
     logger.info("✅ ALL SYSTEMS OPERATIONAL")
     logger.info("=" * 60)
     
     try:
-        # Run ping loop in main thread
+        # Load servers and run the ping loop in the main thread
         run_pings()
     except KeyboardInterrupt:
         logger.info("⏹️  Shutting down gracefully...")
-        client.close()
+        shard_leases.release()
+        result_writer.flush()
+        storage.close()
         logger.info("👋 Goodbye!")